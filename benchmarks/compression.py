@@ -0,0 +1,52 @@
+"""
+This benchmark compares the CPU time each response encoding and level takes
+against the number of bytes it saves, on a card list response made of
+cards and comments like the ones the 'seed' command creates.
+
+Encodings whose library isn't installed are skipped.
+
+Run it from the root of the project with:
+    python -m benchmarks.compression [number of cards]
+"""
+import sys
+import time
+
+from flask import Flask
+
+from benchmarks.json_encoding import make_cards
+from compression import COMPRESSORS, _available_encodings
+from json_provider import FastJSONProvider
+
+# The levels to try for each encoding
+LEVELS = {
+    "gzip": (1, 6, 9),
+    "zstd": (1, 3, 9, 19),
+    "br": (1, 4, 9, 11),
+}
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+
+    app = Flask(__name__)
+    app.json = FastJSONProvider(app)
+    data = app.json._encode(make_cards(count))
+
+    print(f"Compressing {count} cards, {len(data) / 1024:.1f} KiB of JSON")
+    print(f"{'encoding':<10} {'level':>5} {'time':>10} {'size':>12} {'ratio':>7} {'MiB/s':>8}")
+
+    for encoding in _available_encodings():
+        factory, _ = COMPRESSORS[encoding]
+        for level in LEVELS[encoding]:
+            start = time.perf_counter()
+            compressor = factory(level)
+            size = len(compressor.compress(data) + compressor.flush())
+            elapsed = time.perf_counter() - start
+            print(
+                f"{encoding:<10} {level:>5} {elapsed * 1000:>7.1f} ms {size / 1024:>8.1f} KiB "
+                f"{len(data) / size:>6.1f}x {len(data) / 1024 / 1024 / elapsed:>8.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
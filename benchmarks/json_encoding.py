@@ -0,0 +1,139 @@
+"""
+This benchmark compares the time and peak memory it takes to encode a
+100k card list response, like the one returned by GET /cards/.
+
+It compares the standard library json module, which is what Flask uses by
+default, with the FastJSONProvider, both building the whole response and
+streaming it.
+
+The first three runs only encode a list of dicts that was built beforehand,
+so streaming only shows the cost of the final JSON string it avoids. A real
+request first builds that list with cards_schema.dump, which takes most of
+the memory, so the last three runs dump loaded cards and encode them
+together, like cards_schema.jsonify does.
+
+Run it from the root of the project with:
+    python -m benchmarks.json_encoding [number of cards]
+"""
+import json
+import sys
+import time
+import tracemalloc
+from datetime import date
+
+from flask import Flask
+
+import json_provider
+from json_provider import FastJSONProvider
+from models.card import Card, cards_schema
+from models.comment import Comment
+from models.user import User
+
+
+def make_cards(count):
+    """
+    Build a list of cards in the same shape as cards_schema.dump returns.
+    """
+    user = {"id": 1, "name": "admin", "email": "admin@email.com"}
+    return [
+        {
+            "id": i,
+            "title": f"Card number {i}",
+            "description": "Perform mandatory github ops on the project",
+            "status": "To Do",
+            "priority": "High",
+            "date": date.today(),
+            "user": user,
+            "comments": [
+                {"id": i * 2, "message": "Admin is making a comment on this card", "user": user},
+                {"id": i * 2 + 1, "message": "The user is making a comment on this card", "user": user},
+            ],
+        }
+        for i in range(count)
+    ]
+
+
+def make_models(count):
+    """
+    Build a list of cards as they would be loaded from the database, with
+    their user and comments.
+    """
+    user = User(id=1, name="admin", email="admin@email.com")
+    cards = []
+    for i in range(count):
+        card = Card(
+            id=i,
+            title=f"Card number {i}",
+            description="Perform mandatory github ops on the project",
+            status="To Do",
+            priority="High",
+            date=date.today(),
+            user=user,
+        )
+        card.comments = [
+            Comment(id=i * 2, message="Admin is making a comment on this card", user=user),
+            Comment(id=i * 2 + 1, message="The user is making a comment on this card", user=user),
+        ]
+        cards.append(card)
+    return cards
+
+
+def measure(name, func):
+    """
+    Run the function and print how long it took and its peak memory use.
+
+    The time and the memory are measured in separate runs, as tracing
+    memory allocations slows the encoders down unevenly.
+    """
+    start = time.perf_counter()
+    size = func()
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:<32} {elapsed * 1000:>9.1f} ms {peak / 1024 / 1024:>9.1f} MiB peak {size / 1024 / 1024:>9.1f} MiB output")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    cards = make_cards(count)
+
+    app = Flask(__name__)
+    app.json = FastJSONProvider(app)
+
+    def stdlib():
+        return len(json.dumps(cards, default=str, separators=(",", ":")))
+
+    def full():
+        return len(app.json._encode(cards))
+
+    def streamed():
+        return sum(len(chunk) for chunk in app.json._stream(cards))
+
+    print(f"Encoding {count} cards, orjson {'installed' if json_provider.orjson else 'not installed'}")
+    measure("stdlib json.dumps", stdlib)
+    measure("FastJSONProvider", full)
+    measure("FastJSONProvider streamed", streamed)
+
+    models = make_models(count)
+
+    def dump_stdlib():
+        return len(json.dumps(cards_schema.dump(models), default=str, separators=(",", ":")))
+
+    def dump_full():
+        return len(app.json._encode(cards_schema.dump(models)))
+
+    def dump_streamed():
+        return sum(len(chunk) for chunk in app.json._stream(cards_schema.dump(models)))
+
+    print()
+    print(f"Dumping and encoding {count} loaded cards")
+    measure("dump + stdlib json.dumps", dump_stdlib)
+    measure("dump + FastJSONProvider", dump_full)
+    measure("dump + FastJSONProvider streamed", dump_streamed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+This benchmark compares the time each route spends looking up rows with the
+legacy Model.query API, as the controllers used to, against the cached
+statements and db.session.get lookups they use now.
+
+It runs against an in-memory SQLite database, with a new session for each
+lookup like a request gets, so the times are mostly Python overhead: building
+and compiling the query, and loading the rows into objects.
+
+Run it from the root of the project with:
+    python -m benchmarks.query_overhead [iterations]
+"""
+import os
+import sys
+import time
+import warnings
+from datetime import date
+
+from sqlalchemy import event
+from sqlalchemy.exc import LegacyAPIWarning
+
+os.environ.setdefault("DATABASE_URI", "sqlite://")
+os.environ.setdefault("JWT_SECRET_KEY", "benchmark")
+
+from main import create_app
+from init import db
+from models.card import Card, VALID_STATUS, IN_PROGRESS_COUNT, cards_schema
+from models.comment import Comment
+from models.user import User
+from controllers.auth_controller import USER_BY_EMAIL
+from controllers.card_controller import CARD_BY_OWNER, CARDS_BY_USER
+from controllers.comment_controller import COMMENT_BY_OWNER
+
+# The legacy lookups are what's being measured, so don't warn about them
+warnings.filterwarnings("ignore", category=LegacyAPIWarning)
+
+
+def seed(cards, comments):
+    """
+    Create a user with the given number of cards, each with comments.
+    """
+    user = User(name="bench", email="bench@email.com", password="bench")
+    db.session.add(user)
+    for i in range(cards):
+        card = Card(title=f"Card {i}", description="Benchmark", status="To Do", priority="High", date=date.today(), user=user)
+        db.session.add(card)
+        for _ in range(comments):
+            db.session.add(Comment(date=date.today(), message="Benchmark", card=card, user=user))
+    db.session.commit()
+    return user.id
+
+
+def legacy_get_card(user_id, card_id):
+    user = User.query.get(user_id)
+    card = Card.query.get(card_id)
+    return card if card and card.user_id == user.id else None
+
+
+def cached_get_card(user_id, card_id):
+    return db.session.scalar(CARD_BY_OWNER, {"id": card_id, "user_id": user_id})
+
+
+def legacy_get_comment(user_id, comment_id):
+    comment = Comment.query.get(comment_id)
+    user = User.query.get(user_id)
+    return comment if comment and comment.user_id == user.id else None
+
+
+def cached_get_comment(user_id, comment_id):
+    return db.session.scalar(COMMENT_BY_OWNER, {"id": comment_id, "user_id": user_id})
+
+
+def legacy_login(email):
+    return User.query.filter_by(email=email).first()
+
+
+def cached_login(email):
+    return db.session.scalar(USER_BY_EMAIL, {"email": email})
+
+
+def legacy_in_progress():
+    stmt = db.select(db.func.count()).select_from(Card).where(Card.status == VALID_STATUS[1])
+    return db.session.scalar(stmt)
+
+
+def cached_in_progress():
+    return db.session.scalar(IN_PROGRESS_COUNT)
+
+
+def legacy_list_cards(user_id):
+    user = User.query.get(user_id)
+    return cards_schema.dump(Card.query.filter_by(user_id=user.id).all())
+
+
+def cached_list_cards(user_id):
+    return cards_schema.dump(db.session.scalars(CARDS_BY_USER, {"user_id": user_id}).unique().all())
+
+
+def measure(func, iterations, statements):
+    """
+    Return the average time of the function in microseconds, and the number
+    of SQL statements it executes each time.
+    """
+    # Warm up SQLAlchemy's compiled cache
+    func()
+    db.session.remove()
+
+    statements.clear()
+    func()
+    count = len(statements)
+    db.session.remove()
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+        # Each request gets a new session, so nothing is in the identity map
+        db.session.remove()
+    return (time.perf_counter() - start) / iterations * 1_000_000, count
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        user_id = seed(cards=20, comments=3)
+        card_id = db.session.scalar(db.select(Card.id).limit(1))
+        comment_id = db.session.scalar(db.select(Comment.id).limit(1))
+        db.session.remove()
+
+        statements = []
+        event.listen(db.engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+
+        cases = [
+            ("get card", lambda: legacy_get_card(user_id, card_id), lambda: cached_get_card(user_id, card_id)),
+            ("get comment", lambda: legacy_get_comment(user_id, comment_id), lambda: cached_get_comment(user_id, comment_id)),
+            ("login lookup", lambda: legacy_login("bench@email.com"), lambda: cached_login("bench@email.com")),
+            ("validate status", legacy_in_progress, cached_in_progress),
+            ("list 20 cards", lambda: legacy_list_cards(user_id), lambda: cached_list_cards(user_id)),
+        ]
+
+        print(f"{'lookup':<16} {'before':>12} {'after':>12} {'speedup':>8} {'queries':>10}")
+        for name, legacy, cached in cases:
+            before, before_count = measure(legacy, iterations, statements)
+            after, after_count = measure(cached, iterations, statements)
+            print(
+                f"{name:<16} {before:>9.1f} us {after:>9.1f} us {before / after:>7.2f}x "
+                f"{before_count:>4} -> {after_count:<3}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+import zlib
+
+from flask import current_app, request
+
+# zstandard and brotli are optional dependencies, the encodings they provide
+# are only offered when they're installed
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class _BrotliCompressor:
+    """
+    This class gives the brotli compressor the same compress/flush interface
+    as the zlib and zstandard compressors.
+    """
+
+    def __init__(self, level):
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.finish()
+
+
+def _gzip(level):
+    # A wbits of 31 makes zlib write a gzip header and trailer
+    return zlib.compressobj(level, zlib.DEFLATED, 31)
+
+
+def _zstd(level):
+    return zstandard.ZstdCompressor(level=level).compressobj()
+
+
+def _br(level):
+    return _BrotliCompressor(level)
+
+
+def _available_encodings():
+    """
+    Return the encodings that can be used, in the order they're preferred
+    when the client accepts several of them equally.
+    """
+    encodings = []
+    if zstandard is not None:
+        encodings.append("zstd")
+    if brotli is not None:
+        encodings.append("br")
+    encodings.append("gzip")
+    return encodings
+
+
+# The function that creates a compressor for each encoding, and the config
+# key holding its compression level
+COMPRESSORS = {
+    "zstd": (_zstd, "COMPRESS_ZSTD_LEVEL"),
+    "br": (_br, "COMPRESS_BROTLI_LEVEL"),
+    "gzip": (_gzip, "COMPRESS_GZIP_LEVEL"),
+}
+
+
+class Compress:
+    """
+    This class compresses responses with the best encoding that the client
+    accepts in its Accept-Encoding header.
+
+    Only responses with one of the COMPRESS_MIMETYPES are compressed, and
+    only when they're at least COMPRESS_MIN_SIZE bytes. Streamed responses
+    don't have a known size, so they're always compressed, one chunk at a
+    time as they're sent.
+
+    It's set up the same way as the other extensions, by calling init_app
+    with the app.
+    """
+
+    def init_app(self, app):
+        app.config.setdefault("COMPRESS_MIMETYPES", ("application/json",))
+        app.config.setdefault("COMPRESS_MIN_SIZE", 1024)
+        app.config.setdefault("COMPRESS_GZIP_LEVEL", 6)
+        app.config.setdefault("COMPRESS_ZSTD_LEVEL", 3)
+        app.config.setdefault("COMPRESS_BROTLI_LEVEL", 4)
+
+        self.encodings = _available_encodings()
+        app.after_request(self.after_request)
+
+    def after_request(self, response):
+        """
+        Compress the response if it's eligible and the client accepts one of
+        the available encodings.
+        """
+        config = current_app.config
+
+        if response.mimetype not in config["COMPRESS_MIMETYPES"]:
+            return response
+
+        # The response varies on Accept-Encoding whether or not it's compressed
+        response.vary.add("Accept-Encoding")
+
+        if (
+            response.status_code < 200
+            or response.status_code in (204, 206, 304)
+            or response.direct_passthrough
+            or "Content-Encoding" in response.headers
+        ):
+            return response
+
+        encoding = request.accept_encodings.best_match(self.encodings)
+        if encoding is None:
+            return response
+
+        # Small responses aren't worth the CPU it takes to compress them
+        if not response.is_streamed and response.calculate_content_length() < config["COMPRESS_MIN_SIZE"]:
+            return response
+
+        factory, level_key = COMPRESSORS[encoding]
+        compressor = factory(config[level_key])
+
+        if response.is_streamed:
+            # Compress the stream chunk by chunk as it's sent
+            response.response = self._compress_stream(compressor, response.response)
+            response.headers.pop("Content-Length", None)
+        else:
+            data = response.get_data()
+            response.set_data(compressor.compress(data) + compressor.flush())
+
+        response.headers["Content-Encoding"] = encoding
+        return response
+
+    @staticmethod
+    def _compress_stream(compressor, chunks):
+        """
+        Yield the compressed chunks of a streamed response.
+        """
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode("utf-8")
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
@@ -1,4 +1,4 @@
-from init import db, jwt, bcrypt
+from init import db, jwt, bcrypt, rate_limiter
 from models.user import User, user_schema, UserSchema, users_schema
 
 from flask import Blueprint, request
@@ -7,6 +7,18 @@ from datetime import timedelta
 
 auth = Blueprint("auth", __name__, url_prefix="/auth")
 
+# The statements used by the routes are built once, when the module is
+# imported, so SQLAlchemy can reuse their compiled SQL from its cache
+
+# Gets a user by email
+USER_BY_EMAIL = db.select(User).where(User.email == db.bindparam("email"))
+
+# Gets the id of the user with an email, to check if the email is taken
+USER_ID_BY_EMAIL = db.select(User.id).where(User.email == db.bindparam("email"))
+
+# Gets all of the users
+ALL_USERS = db.select(User)
+
 
 @auth.route("/login", methods=["POST"])
 def login():
@@ -25,7 +37,7 @@ def login():
     password = request.json.get("password", None)
 
     # Get the user from the database with the given email
-    user = User.query.filter_by(email=email).first()
+    user = db.session.scalar(USER_BY_EMAIL, {"email": email})
 
     # Check if the user exists and if the password is correct
     if not user or not bcrypt.check_password_hash(user.password, password):
@@ -52,10 +64,10 @@ def register():
     password = body.get("password")
 
     # Check if a user with the same email already exists
-    user = User.query.filter_by(email=email).first()
+    user_id = db.session.scalar(USER_ID_BY_EMAIL, {"email": email})
 
     # If the user already exists, return an error
-    if user:
+    if user_id is not None:
         return {"message": "User already exists"}, 400
 
     # Check if all the required fields are present
@@ -84,7 +96,7 @@ def get_users():
     This function is called when a GET request is sent to the /users endpoint.
     It returns a list of all the users in the database.
     """
-    users = User.query.all()
+    users = db.session.scalars(ALL_USERS).all()
     return users_schema.jsonify(users)
 
 @auth.route("/users/<int:id>", methods=["PUT", "PATCH"])
@@ -96,7 +108,7 @@ def update_user(id):
 
     The request must include a JSON payload with the fields to update, which are
     """
-    user = User.query.get(id)
+    user = db.session.get(User, id)
 
     if not user:
         return {"message": "User not found"}, 404
@@ -115,4 +127,21 @@ def update_user(id):
 
     db.session.commit()
 
-    return user_schema.jsonify(user)
\ No newline at end of file
+    return user_schema.jsonify(user)
+
+@auth.route("/rate-limits", methods=["GET"])
+@jwt_required()
+def get_rate_limits():
+    """
+    This function is called when a GET request is sent to the /rate-limits
+    endpoint. It returns how many requests this process has turned away,
+    by endpoint and by reason, either 'rate' or 'concurrency'.
+
+    Only admins can see the counters.
+    """
+    user = db.session.get(User, get_jwt_identity())
+
+    if not user or not user.is_admin:
+        return {"message": "Unauthorized"}, 401
+
+    return {"rejected": dict(rate_limiter.rejected)}
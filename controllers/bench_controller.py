@@ -0,0 +1,122 @@
+import json
+from datetime import date
+
+import click
+from flask import Blueprint
+from init import db, bcrypt
+
+from models.user import User
+from models.card import Card
+from models.comment import Comment
+from loadgen import ROUTES, parse_mix, login_users, run_load, format_table
+
+bench_commands = Blueprint("bench", __name__)
+
+# The password of every user created by the 'seed' command
+BENCH_PASSWORD = "bench"
+
+# The default mix of routes, including the write-heavy ones
+DEFAULT_MIX = "list_cards=4,get_card=4,list_comments=2,update_card=2,create_card=1,create_comment=1"
+
+
+def bench_email(index):
+    return f"bench{index}@email.com"
+
+
+@bench_commands.cli.command("seed")
+@click.option("--users", default=50, show_default=True, help="The number of users to create")
+@click.option("--cards", default=10, show_default=True, help="The number of cards to create for each user")
+def seed_bench(users, cards):
+    """
+    This is the 'seed' command, which is used to create the users that the
+    'load' command logs in as, each with some cards and comments.
+
+    The users are named bench0@email.com, bench1@email.com and so on, and
+    all have the password 'bench'. Users that already exist are skipped.
+    """
+    existing = set(db.session.scalars(
+        db.select(User.email).where(User.email.in_([bench_email(i) for i in range(users)]))
+    ))
+
+    # Hash the password once, as every user has the same one
+    password = bcrypt.generate_password_hash(BENCH_PASSWORD).decode("utf-8")
+    created = 0
+
+    for i in range(users):
+        if bench_email(i) in existing:
+            continue
+
+        user = User(name=f"bench{i}", email=bench_email(i), password=password)
+        db.session.add(user)
+
+        for j in range(cards):
+            card = Card(
+                title=f"Bench card {j}",
+                description="Created for the load test",
+                status="To Do",
+                priority="Medium",
+                date=date.today(),
+                user=user
+            )
+            db.session.add(card)
+            db.session.add(Comment(date=date.today(), message="Bench comment", card=card, user=user))
+
+        created += 1
+
+    db.session.commit()
+    print(f"Created {created} bench users with {cards} cards each")
+
+
+@bench_commands.cli.command("load")
+@click.argument("url")
+@click.option("--users", default=50, show_default=True, help="The number of bench users to log in as")
+@click.option("--concurrency", default=16, show_default=True, help="The number of requests in flight at once")
+@click.option("--duration", default=30.0, show_default=True, help="How long to send requests for, in seconds")
+@click.option("--interval", default=5.0, show_default=True, help="The length of each interval in the timeline, in seconds")
+@click.option("--mix", default=DEFAULT_MIX, show_default=True, help=f"The weight of each route, from {', '.join(ROUTES)}")
+@click.option("--timeout", default=30.0, show_default=True, help="The timeout of each request, in seconds")
+@click.option("--output", type=click.Path(dir_okay=False, writable=True), help="Write the report to this file as JSON")
+def load_bench(url, users, concurrency, duration, interval, mix, timeout, output):
+    """
+    This is the 'load' command, which is used to find how much traffic a
+    running server at URL can take before it saturates.
+
+    It logs in the users created by the 'bench seed' command through
+    /auth/login, then sends a weighted mix of requests to the card and
+    comment routes from --concurrency workers for --duration seconds. Each
+    worker sends its next request as soon as it gets a response.
+
+    It prints the throughput, the p50, p95 and p99 latency and the error rate
+    of each route, and can write the full report, including a timeline of
+    each --interval, as JSON.
+
+    Every request comes from the same address, so start the server with
+    RATELIMIT_ENABLED=false, or the logins are rate limited.
+    """
+    try:
+        weights = parse_mix(mix)
+    except ValueError as error:
+        raise click.BadParameter(str(error), param_hint="--mix")
+
+    print(f"Logging in {users} users")
+    try:
+        sessions = login_users(url, [bench_email(i) for i in range(users)], BENCH_PASSWORD, concurrency, timeout)
+    except RuntimeError as error:
+        raise click.ClickException(str(error))
+
+    print(f"Sending requests from {concurrency} workers for {duration} seconds")
+    report = run_load(url, sessions, BENCH_PASSWORD, weights, concurrency, duration, interval, timeout)
+
+    # Print the throughput of each interval, so saturation shows up over time
+    for bucket in report["timeline"]:
+        requests = sum(summary["requests"] for summary in bucket["routes"].values())
+        errors = sum(summary["errors"] for summary in bucket["routes"].values())
+        print(f"{bucket['start_s']:>8.1f}s {requests:>8} requests {errors:>6} errors")
+
+    print()
+    print(format_table(report))
+
+    if output:
+        with open(output, "w") as file:
+            json.dump(report, file, indent=2)
+        print(f"Report written to {output}")
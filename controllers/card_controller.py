@@ -4,8 +4,12 @@ from flask import Blueprint, request
 from flask_jwt_extended import jwt_required, get_jwt_identity
 
 from init import db
-from models.card import Card, card_schema, cards_schema
+from idempotency import idempotent
+from versioning import expected_version, etag
+from models.card import Card, card_schema, cards_schema, VALID_STATUS, VALID_PRIORITY
 from models.user import User
+from models.comment import Comment
+from models.archive import CardArchive, CommentArchive
 
 from controllers.comment_controller import comment
 
@@ -19,8 +23,46 @@ card.register_blueprint(comment)
 /cards - POST - Creates a new card
 /cards/<int:id> - PUT, PATCH - Updates a card
 /cards/<int:id> - DELETE - Deletes a card
+/cards - DELETE - Deletes all of the user's cards matching a filter
+
+Both GET routes accept ?include_archived=true to also return archived cards
 """
 
+# The statements used by the routes are built once, when the module is
+# imported, so SQLAlchemy can reuse their compiled SQL from its cache
+
+# Gets a card by id, only if it belongs to the given user
+CARD_BY_OWNER = db.select(Card).where(Card.id == db.bindparam("id"), Card.user_id == db.bindparam("user_id"))
+
+# Gets all of a user's cards, with their comments and the users of both
+# loaded up front rather than one card at a time while serializing
+CARDS_BY_USER = (
+    db.select(Card)
+    .where(Card.user_id == db.bindparam("user_id"))
+    .options(db.joinedload(Card.user), db.selectinload(Card.comments).joinedload(Comment.user))
+)
+
+# Gets all of a user's archived cards, loaded the same way
+ARCHIVED_CARDS_BY_USER = (
+    db.select(CardArchive)
+    .where(CardArchive.user_id == db.bindparam("user_id"))
+    .options(db.joinedload(CardArchive.user), db.selectinload(CardArchive.comments).joinedload(CommentArchive.user))
+)
+
+
+def card_not_owned(id):
+    """
+    Return the error for a card that wasn't found for the user that is logged
+    in, either because it doesn't exist or because it belongs to another user.
+    """
+    # Check if the card doesn't exist
+    if not db.session.get(Card, id):
+        # If the card doesn't exist, return a 404 error
+        return {"message": "404, Card not found"}, 404
+
+    # Otherwise the user is not authorized, return a 401 error
+    return {"message": "Unauthorized"}, 401
+
 @card.route("/", methods=["GET"])
 @jwt_required()
 def get_cards_by_user():
@@ -31,13 +73,20 @@ def get_cards_by_user():
     It first gets the user's id from the JWT token, and then uses that to
     query the database for all cards that have the same user_id. It then
     returns those cards as a JSON response.
+
+    If the include_archived query parameter is true, the user's archived
+    cards are returned after the active ones.
     """
-    # Get the user that is currently logged in
-    user = User.query.get(get_jwt_identity())
+    # Get the id of the user that is currently logged in
+    user_id = get_jwt_identity()
 
     # Query the database for all cards that have the same user_id as the
     # user that is currently logged in
-    cards = Card.query.filter_by(user_id=user.id).all()
+    cards = db.session.scalars(CARDS_BY_USER, {"user_id": user_id}).unique().all()
+
+    # Add the user's archived cards if they were asked for
+    if request.args.get("include_archived", "").lower() == "true":
+        cards += db.session.scalars(ARCHIVED_CARDS_BY_USER, {"user_id": user_id}).unique().all()
 
     # Return the cards as a JSON response
     return cards_schema.jsonify(cards)
@@ -49,36 +98,40 @@ def get_card(id):
     """
     This function is used to get a single card by id.
 
-    It first gets the card with the given id from the database.
-    If the card doesn't exist, it will return a 404 error.
-
-    It then checks if the user that is currently logged in is the same
-    as the user that the card belongs to. If not, it will return a 401
-    error.
+    It gets the card with the given id from the database, only if it
+    belongs to the user that is currently logged in. If it doesn't, it
+    checks whether the card exists, and returns a 404 error if not or a 401
+    error if it belongs to another user.
 
     If the user is authorized, it will return the card as a JSON response.
+
+    If the include_archived query parameter is true and the card is not
+    in the cards table, it is looked up in the archive instead.
     """
-    # Get the card with the given id from the database
-    card = Card.query.get(id)
+    user_id = get_jwt_identity()
 
-    # Get the user that is currently logged in
-    user = User.query.get(get_jwt_identity())
+    # Get the card with the given id from the database, if it's the user's
+    card = db.session.scalar(CARD_BY_OWNER, {"id": id, "user_id": user_id})
 
-    # Check if the card doesn't exist
     if not card:
-        # If the card doesn't exist, return a 404 error
-        return {"message": "404, Card not found"}, 404
-    
-    # Check if the user is authorized to view this card
-    if user.id != card.user_id:
-        # If the user is not authorized, return a 401 error
-        return {"message": "Unauthorized"}, 401
-    
-    # If the user is authorized, return the card as a JSON response
-    return card_schema.jsonify(card)
+        # Fall back to the archive if the card isn't active and it was asked for
+        if request.args.get("include_archived", "").lower() == "true":
+            archived_card = db.session.get(CardArchive, id)
+            if archived_card:
+                if archived_card.user_id != user_id:
+                    return {"message": "Unauthorized"}, 401
+                return card_schema.jsonify(archived_card)
+
+        # Check why the card wasn't found
+        return card_not_owned(id)
+
+    # If the user is authorized, return the card as a JSON response, with its
+    # version in the ETag header
+    return card_schema.jsonify(card), 200, etag(card.version)
 
 @card.route("/", methods=["POST"])
 @jwt_required()
+@idempotent
 def create_card():
     """
     This function is called when a POST request is sent to the root of the
@@ -90,15 +143,18 @@ def create_card():
     - status: The status of the new card
     - priority: The priority of the new card
 
+    The request can include an Idempotency-Key header, so that a retry of the
+    request returns the same card rather than creating a new one.
+
     The function does the following:
     1. Gets the user that is currently logged in
     2. Creates a new card with the given title, description, status, and priority
     3. Sets the date of the new card to today
     4. Sets the user of the new card to the user that is currently logged in
-    5. Commits the new card to the database
+    5. Adds the new card to the database, to be committed with the response
     6. Returns the new card as a JSON response
     """
-    user = User.query.get(get_jwt_identity())
+    user = db.session.get(User, get_jwt_identity())
 
     body = card_schema.load(request.json)
 
@@ -112,9 +168,10 @@ def create_card():
     today = date.today()
     new_card = Card(title=title, description=description, status=status, priority=priority, date=today, user=user)
 
-    # Commit the new card to the database
+    # Add the new card to the database, it's committed by the idempotent
+    # decorator along with the stored response
     db.session.add(new_card)
-    db.session.commit()
+    db.session.flush()
 
     # Return the new card as a JSON response
     return card_schema.jsonify(new_card)
@@ -135,44 +192,83 @@ def update_card(id):
     - priority: The priority of the card
     - date: The date of the card
 
+    To avoid overwriting someone else's changes, the request can include the
+    version of the card it was based on, either in an If-Match header or in
+    the version field of the JSON payload. If the card has been updated since,
+    the update is refused with a 412 or 409 status code respectively.
+
     The function does the following:
-    1. Gets the user that is currently logged in
-    2. Gets the card with the given id from the database
-    3. Checks if the user is authorized to update the card, and if not, returns
-    an error message with a 401 status code
-    4. If the request is a PATCH, it updates the fields specified in the JSON
+    1. Updates the card with a single UPDATE statement, which only matches
+    the card if it belongs to the user that is logged in and, when a version
+    was given, if it's still at that version
+    2. If no card was updated, gets the card to find out why, and returns
+    an error message with a 404, 401, 412 or 409 status code
+    3. If the request is a PATCH, it updates the fields specified in the JSON
     payload.
-    5. If the request is a PUT, it updates all the fields with the ones specified
+    4. If the request is a PUT, it updates all the fields with the ones specified
     in the JSON payload.
-    6. Commits the updated card to the database
-    7. Returns the updated card as a JSON response
+    5. Commits the updated card to the database
+    6. Returns the updated card as a JSON response, with its new version in
+    the ETag header
     """
-    user = User.query.get(get_jwt_identity())
-    card = Card.query.get(id)
+    user_id = get_jwt_identity()
 
-    # Check if the card doesn't exist
-    if not card:
-        # If the card doesn't exist, return an error message with a 404 status code
-        return {"message": "404, Card not found"}, 404
-
-    # Check if the user is authorized to update the card
-    if user.id != card.user_id:
-        # If the user is not authorized, return an error message with a 401 status code
-        return {"message": "Unauthorized"}, 401
-    
     body = card_schema.load(request.json, partial=True)
-
-    card.title = body.get("title") or card.title
-    card.description = body.get("description") or card.description
-    card.status = body.get("status") or card.status
-    card.priority = body.get("priority") or card.priority
-    card.date = body.get("date") or card.date
+    version, conflict_status = expected_version(body.get("version"))
+
+    # Only update the fields that were given a value
+    values = {
+        field: body[field]
+        for field in ("title", "description", "status", "priority", "date")
+        if body.get(field)
+    }
+
+    # Update the card and increment its version in one statement, checking
+    # the owner and the version in the WHERE clause rather than loading the
+    # card first
+    stmt = (
+        db.update(Card)
+        .where(Card.id == id, Card.user_id == user_id)
+        .values(**values, version=Card.version + 1)
+    )
+    if version is not None:
+        stmt = stmt.where(Card.version == version)
+
+    # Get the updated card back from the UPDATE, so a delete that lands
+    # after the commit can't leave nothing to return
+    card = db.session.scalar(
+        stmt.returning(Card),
+        execution_options={"synchronize_session": False, "populate_existing": True}
+    )
+
+    # Check why the card wasn't updated
+    if card is None:
+        db.session.rollback()
+        card = db.session.get(Card, id)
+
+        # Check if the card doesn't exist
+        if not card:
+            # If the card doesn't exist, return an error message with a 404 status code
+            return {"message": "404, Card not found"}, 404
+
+        # Check if the user is authorized to update the card
+        if user_id != card.user_id:
+            # If the user is not authorized, return an error message with a 401 status code
+            return {"message": "Unauthorized"}, 401
+
+        # Otherwise the card has been updated since the given version
+        return {"message": "Card has been updated by someone else", "version": card.version}, conflict_status, etag(card.version)
+
+    # Serialize the updated card before committing, while its row is still
+    # locked by the UPDATE
+    response = card_schema.jsonify(card)
+    version = card.version
 
     # Commit the updated card to the database
     db.session.commit()
 
     # Return the updated card as a JSON response
-    return card_schema.jsonify(card)
+    return response, 200, etag(version)
 
 
 @card.route("/<int:id>", methods=["DELETE"])
@@ -183,34 +279,85 @@ def delete_card(id):
     This is used to delete an existing card in the database.
 
     The function does the following:
-    1. Gets the user that is currently logged in
-    2. Gets the card with the given id from the database
-    3. Checks if the user is authorized to delete the card, and if not, returns
-    an error message with a 401 status code
-    4. If the user is authorized, it deletes the card from the database
-    5. Commits the deletion to the database
-    6. Returns a success message as a JSON response
+    1. Deletes the card with the given id from the database, only if it
+    belongs to the user that is currently logged in
+    2. If no card was deleted, returns an error message with a 404 status
+    code if the card doesn't exist, or a 401 status code if it belongs to
+    another user
+    3. Commits the deletion to the database
+    5. Returns a success message as a JSON response
     """
-    user = User.query.get(get_jwt_identity())
-    card = Card.query.get(id)
+    # Delete the card from the database, only if it belongs to the user, with
+    # a single DELETE statement rather than the ORM, which would also check
+    # the card's version and fail if it was updated in the meantime
+    # The comments are deleted by the database through ON DELETE CASCADE
+    title = db.session.scalar(
+        db.delete(Card).where(Card.id == id, Card.user_id == get_jwt_identity()).returning(Card.title),
+        execution_options={"synchronize_session": False}
+    )
+
+    # Check why the card wasn't deleted
+    if title is None:
+        db.session.rollback()
+        return card_not_owned(id)
 
-    # Check if the card doesn't exist
-    if not card:
-        # If the card doesn't exist, return a 404 error
-        return {"message": "404, Card not found"}, 404
-    
-    # Check if the user is authorized to delete the card
-    if user.id != card.user_id:
-        # If the user is not authorized, return an error message with a 401 status code
-        return {"message": "Unauthorized"}, 401
-    
-
-    
-    # Delete the card from the database
-    db.session.delete(card)
-    
     # Commit the deletion to the database
     db.session.commit()
 
     # Return a success message as a JSON response
-    return {"message": f"Card {card.title} deleted successfully"}
+    return {"message": f"Card {title} deleted successfully"}
+
+
+@card.route("/", methods=["DELETE"])
+@jwt_required()
+def delete_cards():
+    """
+    This function is called when a DELETE request is sent to the root of the
+    /cards endpoint. This is used to delete all of the cards belonging to the
+    user that is logged in which match a filter.
+
+    The filter is given in the query string, and at least one of the
+    following must be present:
+    - status: Only delete cards with this status
+    - priority: Only delete cards with this priority
+    - before: Only delete cards dated before this date (YYYY-MM-DD)
+
+    The cards are deleted with a single DELETE statement, and their comments
+    are deleted by the database through ON DELETE CASCADE, so none of the rows
+    are loaded into the session.
+    """
+    status = request.args.get("status")
+    priority = request.args.get("priority")
+    before = request.args.get("before")
+
+    # Refuse to delete every card when no filter was given
+    if not status and not priority and not before:
+        return {"message": "At least one of status, priority or before is required"}, 400
+
+    # Only ever delete the cards of the user that is logged in
+    stmt = db.delete(Card).where(Card.user_id == get_jwt_identity())
+
+    if status:
+        if status not in VALID_STATUS:
+            return {"message": f"Invalid status, must be one of {', '.join(VALID_STATUS)}"}, 400
+        stmt = stmt.where(Card.status == status)
+
+    if priority:
+        if priority not in VALID_PRIORITY:
+            return {"message": f"Invalid priority, must be one of {', '.join(VALID_PRIORITY)}"}, 400
+        stmt = stmt.where(Card.priority == priority)
+
+    if before:
+        try:
+            before = date.fromisoformat(before)
+        except ValueError:
+            return {"message": "Invalid date, must be in the format YYYY-MM-DD"}, 400
+        stmt = stmt.where(Card.date < before)
+
+    # Delete the matching cards without synchronising the session, as none of
+    # them have been loaded
+    result = db.session.execute(stmt, execution_options={"synchronize_session": False})
+    db.session.commit()
+
+    # Return the number of deleted cards as a JSON response
+    return {"message": f"{result.rowcount} cards deleted successfully", "deleted": result.rowcount}
@@ -1,11 +1,14 @@
-from flask import Blueprint
+import click
+from flask import Blueprint, current_app
 from init import db, bcrypt
 
 from models.user import User
 from models.card import Card
 from models.comment import Comment
+from models.idempotency_key import IdempotencyKey
+from jobs import archive_batch, purge_user, start_workers
 
-from datetime import date
+from datetime import date, datetime, timedelta
 db_commands = Blueprint("db", __name__)
 
 @db_commands.cli.command("create")
@@ -181,3 +184,107 @@ def seed_db():
     # This will save all of the changes we made in the database
     db.session.commit()
     print("Database seeded")
+
+@db_commands.cli.command("purge")
+@click.argument("email")
+def purge_db_user(email):
+    """
+    This is the 'purge' command, which is used to remove all of the cards and
+    comments belonging to the user with the given email.
+
+    The user themselves is kept. The rows are removed with one DELETE
+    statement per table rather than being loaded into the session and deleted
+    one at a time, so purging a busy user stays cheap.
+    """
+    # Find the id of the user with the given email
+    user_id = db.session.scalar(db.select(User.id).where(User.email == email))
+
+    if user_id is None:
+        print(f"User {email} not found")
+        return
+
+    cards, comments = purge_user(user_id)
+    db.session.commit()
+    print(f"Purged {cards} cards and {comments} comments for {email}")
+
+@db_commands.cli.command("archive")
+@click.option("--older-than", default=90, show_default=True, help="Archive cards dated more than this many days ago")
+@click.option("--batch-size", default=1000, show_default=True, help="The number of cards to move per transaction")
+def archive_db(older_than, batch_size):
+    """
+    This is the 'archive' command, which is used to move finished cards, and
+    their comments, out of the cards and comments tables and into the
+    cards_archive and comments_archive tables.
+
+    A card is archived when its status is one of the terminal statuses
+    (Completed or Deployed) and it is dated more than --older-than days ago.
+    The rows are moved with INSERT ... SELECT and DELETE statements, one batch
+    of cards per transaction, so the command can be stopped and rerun at any
+    point without holding long locks on the hot tables.
+    """
+    cutoff = date.today() - timedelta(days=older_than)
+    total_cards = 0
+    total_comments = 0
+
+    while True:
+        cards, comments = archive_batch(cutoff, batch_size)
+        if not cards:
+            break
+
+        # Commit each batch on its own so progress is kept if the command stops
+        db.session.commit()
+
+        total_cards += cards
+        total_comments += comments
+        print(f"Archived {total_cards} cards and {total_comments} comments so far")
+
+    print(f"Archived {total_cards} cards and {total_comments} comments older than {cutoff}")
+
+@db_commands.cli.command("expire-idempotency-keys")
+@click.option("--older-than", type=int, help="Expire keys stored more than this many hours ago, defaults to IDEMPOTENCY_KEY_TTL")
+def expire_idempotency_keys(older_than):
+    """
+    This is the 'expire-idempotency-keys' command, which is used to delete
+    the stored Idempotency-Key responses that are older than their time to
+    live. Once a key has been deleted, a request with it runs again.
+
+    It's meant to be run regularly, for example from cron.
+    """
+    if older_than is None:
+        older_than = current_app.config["IDEMPOTENCY_KEY_TTL"]
+
+    cutoff = datetime.now() - timedelta(hours=older_than)
+    result = db.session.execute(
+        db.delete(IdempotencyKey).where(IdempotencyKey.created_at < cutoff),
+        execution_options={"synchronize_session": False}
+    )
+    db.session.commit()
+    print(f"Expired {result.rowcount} idempotency keys")
+
+@db_commands.cli.command("worker")
+@click.option("--threads", default=1, show_default=True, help="The number of jobs to run at the same time")
+@click.option("--burst", is_flag=True, help="Exit once there are no jobs left instead of waiting for more")
+def worker(threads, burst):
+    """
+    This is the 'worker' command, which is used to run the jobs created with
+    POST /jobs.
+
+    Each thread claims one job at a time and runs it to completion, saving
+    its progress after every chunk. Jobs left running by a worker that
+    stopped are picked up again once JOB_STALE_AFTER seconds have passed.
+    """
+    app = current_app._get_current_object()
+    workers, stop = start_workers(app, threads, burst)
+    print(f"Worker started with {threads} threads")
+
+    try:
+        for thread in workers:
+            # Join with a timeout so Ctrl+C is handled straight away
+            while thread.is_alive():
+                thread.join(1)
+    except KeyboardInterrupt:
+        stop.set()
+        for thread in workers:
+            thread.join()
+
+    print("Worker stopped")
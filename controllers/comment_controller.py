@@ -4,32 +4,75 @@ from flask import Blueprint, request
 from flask_jwt_extended import jwt_required, get_jwt_identity
 
 from init import db
+from idempotency import idempotent
+from versioning import expected_version, etag
 from models.card import Card
-from models.user import User
 from models.comment import Comment, comment_schema, comments_schema
+from models.archive import CardArchive, CommentArchive
 
 
 comment = Blueprint("comment", __name__, url_prefix="/<int:card_id>/comments")
 
+# The statements used by the routes are built once, when the module is
+# imported, so SQLAlchemy can reuse their compiled SQL from its cache
+
+# Gets the id of a card, only if it belongs to the given user
+CARD_ID_BY_OWNER = db.select(Card.id).where(Card.id == db.bindparam("id"), Card.user_id == db.bindparam("user_id"))
+
+# Gets an archived card by id with its comments, only if it belongs to the
+# given user
+ARCHIVED_CARD_BY_OWNER = (
+    db.select(CardArchive)
+    .where(CardArchive.id == db.bindparam("id"), CardArchive.user_id == db.bindparam("user_id"))
+    .options(db.selectinload(CardArchive.comments).joinedload(CommentArchive.user))
+)
+
+# Gets a comment by id, only if it belongs to the given user
+COMMENT_BY_OWNER = db.select(Comment).where(Comment.id == db.bindparam("id"), Comment.user_id == db.bindparam("user_id"))
+
+# Gets all of the comments on a card, with their users and card loaded up
+# front rather than one comment at a time while serializing
+COMMENTS_BY_CARD = (
+    db.select(Comment)
+    .where(Comment.card_id == db.bindparam("card_id"))
+    .options(db.joinedload(Comment.user), db.joinedload(Comment.card))
+)
+
 
 @comment.route("/", methods=["GET"])
 @jwt_required()
 def get_comments_by_card(card_id):
     """
-    This function returns all the comments associated with the user that is
-    currently logged in.
+    This function returns all the comments on the card with the given id.
+
+    It checks that the card belongs to the user that is currently logged in,
+    returning a 404 error if the card doesn't exist or a 401 error if it
+    belongs to another user. It then queries the database for all comments
+    that have the same card_id, loading their users and card in the same
+    queries, and returns those comments as a JSON response.
 
-    It first gets the user's id from the JWT token, and then uses that to
-    query the database for all comments that have the same user_id. It then
-    returns those comments as a JSON response.
+    If the include_archived query parameter is true and the card has been
+    archived, the archived comments of the card are returned.
     """
-    # Get the user that is currently logged in
-    user = User.query.get(get_jwt_identity())
-    card = Card.query.get(card_id)
+    user_id = get_jwt_identity()
+
+    # Check that the card exists and belongs to the user in one query
+    if db.session.scalar(CARD_ID_BY_OWNER, {"id": card_id, "user_id": user_id}) is None:
+        # Fall back to the archive if the card isn't active and it was asked for
+        if request.args.get("include_archived", "").lower() == "true":
+            archived_card = db.session.scalar(ARCHIVED_CARD_BY_OWNER, {"id": card_id, "user_id": user_id})
+            if archived_card:
+                return comments_schema.jsonify(archived_card.comments)
+            if db.session.get(CardArchive, card_id):
+                return {"message": "Unauthorized"}, 401
+
+        # Check why the card wasn't found
+        if not db.session.get(Card, card_id):
+            return {"message": "Card not found"}, 404
+        return {"message": "Unauthorized"}, 401
 
-    # Query the database for all comments that have the same user_id as the
-    # user that is currently logged in
-    comments = Comment.query.filter_by(card_id=card.id).all()
+    # Query the database for all comments on the card
+    comments = db.session.scalars(COMMENTS_BY_CARD, {"card_id": card_id}).all()
 
     # Return the comments as a JSON response
     return comments_schema.jsonify(comments)
@@ -37,26 +80,33 @@ def get_comments_by_card(card_id):
 
 @comment.route("/", methods=["POST"])
 @jwt_required()
+@idempotent
 def create_comment(card_id):
-    card = Card.query.get(card_id)
-
-    if not card:
-        return {"message": "Card not found"}, 404
+    """
+    This function is used to create a new comment on a card.
 
-    user = User.query.get(get_jwt_identity())
+    The request can include an Idempotency-Key header, so that a retry of the
+    request returns the same comment rather than creating a new one.
+    """
+    user_id = get_jwt_identity()
 
-    if user.id != card.user_id:
+    # Check that the card exists and belongs to the user in one query
+    if db.session.scalar(CARD_ID_BY_OWNER, {"id": card_id, "user_id": user_id}) is None:
+        if not db.session.get(Card, card_id):
+            return {"message": "Card not found"}, 404
         return {"message": "Unauthorized"}, 401
 
     new_comment = Comment(
         date = date.today(),
         message=request.json["message"],
-        card_id=card.id,
-        user_id=user.id
+        card_id=card_id,
+        user_id=user_id
     )
 
+    # The comment is committed by the idempotent decorator, along with the
+    # stored response
     db.session.add(new_comment)
-    db.session.commit()
+    db.session.flush()
 
     return comment_schema.jsonify(new_comment), 201
 
@@ -67,35 +117,33 @@ def delete_comment(card_id, comment_id):
     """
     This function is used to delete a comment by id.
 
-    It first gets the comment with the given id from the database.
-    If the comment doesn't exist, it will return a 404 error.
-
-    It then checks if the user that is currently logged in is the same
-    as the user that the comment belongs to. If not, it will return a 401
-    error.
+    It deletes the comment with the given id from the database, only if it
+    belongs to the user that is currently logged in. If no comment was
+    deleted, it checks whether the comment exists, and returns a 404 error
+    if not or a 401 error if it belongs to another user.
 
-    If the user is authorized, it will delete the comment from the database
-    and return a success message as a JSON response.
+    If the comment was deleted, it will return a success message as a JSON
+    response.
     """
-    # Get the comment with the given id from the database
-    comment = Comment.query.get(comment_id)
-
-    # Check if the comment exists
-    if not comment:
-        # If not, return a 404 error
-        return {"message": "Comment not found"}, 404
-    
-    # Get the user that is currently logged in
-    user = User.query.get(get_jwt_identity())
-
-    # Check if the user that is currently logged in is the same as the user
-    # that the comment belongs to
-    if user.id != comment.user_id:
-        # If not, return a 401 error
+    # Delete the comment from the database, only if it's the user's, with a
+    # single DELETE statement rather than the ORM, which would also check the
+    # comment's version and fail if it was updated in the meantime
+    result = db.session.execute(
+        db.delete(Comment).where(Comment.id == comment_id, Comment.user_id == get_jwt_identity()),
+        execution_options={"synchronize_session": False}
+    )
+
+    if result.rowcount == 0:
+        db.session.rollback()
+
+        # Check if the comment exists
+        if not db.session.get(Comment, comment_id):
+            # If not, return a 404 error
+            return {"message": "Comment not found"}, 404
+
+        # Otherwise it belongs to another user, return a 401 error
         return {"message": "Unauthorized"}, 401
-    
-    # Delete the comment from the database
-    db.session.delete(comment)
+
     db.session.commit()
 
     # Return a success message as a JSON response
@@ -107,37 +155,74 @@ def update_comment(card_id, comment_id):
     """
     This function is used to update a comment by id.
 
-    It first gets the comment with the given id from the database.
-    If the comment doesn't exist, it will return a 404 error.
+    It updates the comment with a single UPDATE statement, which only matches
+    the comment if it belongs to the user that is currently logged in.
 
-    It then checks if the user that is currently logged in is the same
-    as the user that the comment belongs to. If not, it will return a 401
-    error.
+    To avoid overwriting someone else's changes, the request can include the
+    version of the comment it was based on, either in an If-Match header or
+    in the version field of the JSON payload, and the UPDATE then also only
+    matches the comment if it's still at that version.
 
-    If the user is authorized, it will update the comment in the database
-    and return a success message as a JSON response.
+    If no comment was updated, it gets the comment to find out why. If the
+    comment doesn't exist, it will return a 404 error. If it belongs to
+    another user, it will return a 401 error. If it has been updated since
+    the given version, it will return a 412 error for If-Match, or a 409
+    error for the version field.
+
+    If the comment was updated, it will return the comment as a JSON
+    response, with its new version in the ETag header.
     """
-    # Get the comment with the given id from the database
-    comment = Comment.query.get(comment_id)
-
-    # Check if the comment exists
-    if not comment:
-        # If not, return a 404 error
-        return {"message": "Comment not found"}, 404
-    
-    # Get the user that is currently logged in
-    user = User.query.get(get_jwt_identity())
-
-    # Check if the user that is currently logged in is the same as the user
-    # that the comment belongs to
-    if user.id != comment.user_id:
-        # If not, return a 401 error
-        return {"message": "Unauthorized"}, 401
-    
-    # Update the comment in the database
-    comment.message = request.json["message"]
+    user_id = get_jwt_identity()
+
+    body = comment_schema.load(request.json, partial=True)
+    version, conflict_status = expected_version(body.get("version"))
+
+    # Only update the message if it was sent
+    values = {"version": Comment.version + 1}
+    if "message" in body:
+        values["message"] = body["message"]
+
+    # Update the comment and increment its version in one statement
+    stmt = (
+        db.update(Comment)
+        .where(Comment.id == comment_id, Comment.user_id == user_id)
+        .values(**values)
+    )
+    if version is not None:
+        stmt = stmt.where(Comment.version == version)
+
+    # Get the updated comment back from the UPDATE, so a delete that lands
+    # after the commit can't leave nothing to return
+    comment = db.session.scalar(
+        stmt.returning(Comment),
+        execution_options={"synchronize_session": False, "populate_existing": True}
+    )
+
+    # Check why the comment wasn't updated
+    if comment is None:
+        db.session.rollback()
+        comment = db.session.get(Comment, comment_id)
+
+        # Check if the comment exists
+        if not comment:
+            # If not, return a 404 error
+            return {"message": "Comment not found"}, 404
+
+        # Check if the user that is currently logged in is the same as the user
+        # that the comment belongs to
+        if user_id != comment.user_id:
+            # If not, return a 401 error
+            return {"message": "Unauthorized"}, 401
+
+        # Otherwise the comment has been updated since the given version
+        return {"message": "Comment has been updated by someone else", "version": comment.version}, conflict_status, etag(comment.version)
+
+    # Serialize the updated comment before committing, while its row is
+    # still locked by the UPDATE
+    response = comment_schema.jsonify(comment)
+    version = comment.version
 
     db.session.commit()
 
-    # Return a success message as a JSON response
-    return comment_schema.jsonify(comment), 200
+    # Return the updated comment as a JSON response
+    return response, 200, etag(version)
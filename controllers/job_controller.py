@@ -0,0 +1,80 @@
+from datetime import datetime
+
+from flask import Blueprint, request
+from flask_jwt_extended import jwt_required, get_jwt_identity
+
+from init import db
+from jobs import JOB_KINDS
+from models.job import Job, job_schema
+from models.user import User
+
+jobs = Blueprint("jobs", __name__, url_prefix="/jobs")
+
+"""
+/jobs - POST - Creates a new job, which is run by a worker
+/jobs/<int:id> - GET - Returns the status and progress of a job
+"""
+
+@jobs.route("/", methods=["POST"])
+@jwt_required()
+def create_job():
+    """
+    This function is called when a POST request is sent to the root of the
+    /jobs endpoint. This is used to run a long running operation in the
+    background instead of in the request.
+
+    The request must include a JSON payload with the following fields:
+    - kind: The kind of job, one of 'archive', 'delete_cards' or 'purge'
+    - params: The parameters of the job
+
+    The 'archive' and 'purge' jobs can only be created by admins, and take the
+    same parameters as the commands of the same name. The 'delete_cards' job
+    deletes the user's cards matching the same filters as DELETE /cards.
+
+    The job is only saved here, and is run by a worker, either
+    'flask db worker' or the worker threads started with JOB_WORKERS. It
+    returns the job with a 202 status code, and its progress can be followed
+    with GET /jobs/<id>.
+    """
+    user = db.session.get(User, get_jwt_identity())
+
+    kind = request.json.get("kind")
+    if kind not in JOB_KINDS:
+        return {"message": f"Invalid kind, must be one of {', '.join(JOB_KINDS)}"}, 400
+
+    schema, admin_only, _ = JOB_KINDS[kind]
+
+    # Check if the user is allowed to create this kind of job
+    if admin_only and not user.is_admin:
+        return {"message": "Unauthorized"}, 401
+
+    # Validate the parameters, and store them as JSON
+    params = schema.dump(schema.load(request.json.get("params") or {}))
+
+    job = Job(kind=kind, params=params, user_id=user.id, created_at=datetime.now())
+    db.session.add(job)
+    db.session.commit()
+
+    return job_schema.jsonify(job), 202, {"Location": f"/jobs/{job.id}"}
+
+
+@jobs.route("/<int:id>", methods=["GET"])
+@jwt_required()
+def get_job(id):
+    """
+    This function is used to get the status and progress of a job by id.
+
+    Jobs can be seen by the user that created them, and by admins.
+    """
+    job = db.session.get(Job, id)
+
+    if not job:
+        return {"message": "Job not found"}, 404
+
+    user = db.session.get(User, get_jwt_identity())
+
+    # Check if the user is allowed to see the job
+    if user.id != job.user_id and not user.is_admin:
+        return {"message": "Unauthorized"}, 401
+
+    return job_schema.jsonify(job)
@@ -0,0 +1,177 @@
+import hashlib
+from datetime import datetime, timedelta
+from functools import wraps
+
+from flask import current_app, make_response, request
+from flask_jwt_extended import get_jwt_identity
+from sqlalchemy.exc import IntegrityError
+
+from init import db
+from models.idempotency_key import IdempotencyKey
+
+
+def _fingerprint():
+    """
+    Return a hash of the method, path and body of the current request.
+    """
+    digest = hashlib.sha256()
+    digest.update(request.method.encode("utf-8"))
+    digest.update(b" ")
+    digest.update(request.path.encode("utf-8"))
+    digest.update(b"\n")
+    digest.update(request.get_data())
+    return digest.hexdigest()
+
+
+def idempotent(view):
+    """
+    This decorator makes a route safe to retry by sending the same
+    Idempotency-Key header with each attempt.
+
+    The first request with a key claims the key before running the route.
+    The route only flushes its changes, and they are committed along with
+    the response, so a key either has a stored response or the route's
+    changes were never saved. A retry with the same key gets the stored
+    response back without the route running again. A retry that arrives
+    while the first request is still running gets a 409 error, and reusing
+    a key for a different request gets a 422 error. Responses with a 5xx
+    status code aren't stored, so those requests can be retried.
+
+    A claim is a lease of IDEMPOTENCY_KEY_LEASE seconds. If the request that
+    claimed the key dies without a response, a retry after the lease takes
+    the key over and runs the route, and the first request can no longer
+    store its response. Keys older than IDEMPOTENCY_KEY_TTL hours are taken
+    over in the same way, even if they haven't been deleted yet.
+
+    Requests without the header run as normal, and their changes are
+    committed after the route. It must be used below jwt_required, as keys
+    are stored for each user.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get("Idempotency-Key")
+
+        # Run the route as normal if there's no key
+        if not key:
+            response = view(*args, **kwargs)
+            db.session.commit()
+            return response
+
+        if len(key) > 255:
+            return {"message": "Idempotency-Key must be at most 255 characters"}, 400
+
+        user_id = get_jwt_identity()
+        fingerprint = _fingerprint()
+        claimed_at = datetime.now()
+
+        # Claim the key before running the route, the primary key makes sure
+        # only one request with the key can do this
+        record = IdempotencyKey(user_id=user_id, key=key, fingerprint=fingerprint, created_at=claimed_at, claimed_at=claimed_at)
+        db.session.add(record)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            if not _take_over(user_id, key, fingerprint, claimed_at):
+                return _replay(user_id, key, fingerprint)
+
+        try:
+            response = make_response(view(*args, **kwargs))
+        except Exception:
+            # Release the key so the request can be retried
+            _release(user_id, key, claimed_at)
+            raise
+
+        if response.status_code >= 500:
+            _release(user_id, key, claimed_at)
+            return response
+
+        # Store the response in the same transaction as the route's changes,
+        # only if no other request has taken the key over in the meantime
+        stored = db.session.execute(
+            db.update(IdempotencyKey)
+            .where(_claimed_by(user_id, key, claimed_at))
+            .values(status_code=response.status_code, response=response.get_data()),
+            execution_options={"synchronize_session": False}
+        )
+        if stored.rowcount != 1:
+            db.session.rollback()
+            return {"message": "A request with this Idempotency-Key took too long and was retried"}, 409
+
+        db.session.commit()
+
+        return response
+
+    return wrapper
+
+
+def _claimed_by(user_id, key, claimed_at):
+    """
+    Return the condition matching a key that is still claimed at the given time.
+    """
+    return db.and_(
+        IdempotencyKey.user_id == user_id,
+        IdempotencyKey.key == key,
+        IdempotencyKey.claimed_at == claimed_at,
+    )
+
+
+def _take_over(user_id, key, fingerprint, claimed_at):
+    """
+    Claim a key whose lease has run out without a response, or which has
+    outlived its time to live. Returns whether the key was claimed.
+    """
+    config = current_app.config
+    lease_cutoff = claimed_at - timedelta(seconds=config["IDEMPOTENCY_KEY_LEASE"])
+    ttl_cutoff = claimed_at - timedelta(hours=config["IDEMPOTENCY_KEY_TTL"])
+
+    # A single UPDATE, so only one retry can take the key over
+    result = db.session.execute(
+        db.update(IdempotencyKey)
+        .where(
+            IdempotencyKey.user_id == user_id,
+            IdempotencyKey.key == key,
+            db.or_(
+                db.and_(IdempotencyKey.status_code.is_(None), IdempotencyKey.claimed_at < lease_cutoff),
+                IdempotencyKey.created_at < ttl_cutoff,
+            ),
+        )
+        .values(fingerprint=fingerprint, created_at=claimed_at, claimed_at=claimed_at, status_code=None, response=None),
+        execution_options={"synchronize_session": False}
+    )
+    db.session.commit()
+    return result.rowcount == 1
+
+
+def _replay(user_id, key, fingerprint):
+    """
+    Return the stored response for a key that has already been used.
+    """
+    record = db.session.get(IdempotencyKey, (user_id, key))
+
+    # The key was released between claiming it and getting it
+    if record is None:
+        return {"message": "A request with this Idempotency-Key failed, please retry"}, 409
+
+    if record.fingerprint != fingerprint:
+        return {"message": "Idempotency-Key has already been used for a different request"}, 422
+
+    if record.status_code is None:
+        return {"message": "A request with this Idempotency-Key is in progress"}, 409, {"Retry-After": "1"}
+
+    response = current_app.response_class(record.response, status=record.status_code, mimetype="application/json")
+    response.headers["Idempotent-Replayed"] = "true"
+    return response
+
+
+def _release(user_id, key, claimed_at):
+    """
+    Delete a claimed key, after the request it was claimed for has failed,
+    unless another request has taken it over.
+    """
+    db.session.rollback()
+    db.session.execute(
+        db.delete(IdempotencyKey).where(_claimed_by(user_id, key, claimed_at)),
+        execution_options={"synchronize_session": False}
+    )
+    db.session.commit()
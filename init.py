@@ -3,7 +3,14 @@ from flask_marshmallow import Marshmallow
 from flask_bcrypt import Bcrypt
 from flask_jwt_extended import JWTManager
 
+from compression import Compress
+from profiler import Profiler
+from ratelimit import RateLimiter
+
 db = SQLAlchemy()
 ma = Marshmallow()
 bcrypt = Bcrypt()
 jwt = JWTManager()
+compress = Compress()
+profiler = Profiler()
+rate_limiter = RateLimiter()
@@ -0,0 +1,365 @@
+import threading
+from datetime import date, datetime, timedelta
+
+from flask import current_app
+from marshmallow import Schema, fields, validates_schema, ValidationError
+from marshmallow.validate import OneOf, Range
+
+from init import db
+from models.archive import CardArchive, CommentArchive, ARCHIVE_STATUS
+from models.card import Card, VALID_STATUS, VALID_PRIORITY
+from models.comment import Comment
+from models.job import Job, JOB_STATUS
+from models.user import User
+
+
+def archive_batch(cutoff, batch_size):
+    """
+    Move the next batch of finished cards dated before the cutoff, and their
+    comments, into the archive tables.
+
+    Returns the number of cards and comments that were moved, which are both
+    0 once there's nothing left to archive. The caller commits.
+    """
+    # Get the next batch of cards to archive, and lock them until the caller
+    # commits, so no comments can be added to them and their status can't
+    # change while they're moved. SKIP LOCKED leaves the cards another
+    # archive run is moving to that run
+    ids = db.session.scalars(
+        db.select(Card.id)
+        .where(Card.status.in_(ARCHIVE_STATUS), Card.date < cutoff)
+        .order_by(Card.id)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    ).all()
+
+    if not ids:
+        return 0, 0
+
+    # Copy the cards, then their comments, into the archive tables
+    db.session.execute(db.insert(CardArchive).from_select(
+        ["id", "title", "description", "status", "priority", "date", "user_id", "archived_at"],
+        db.select(Card.id, Card.title, Card.description, Card.status, Card.priority, Card.date, Card.user_id, db.literal(date.today(), db.Date))
+        .where(Card.id.in_(ids))
+    ))
+    comments = db.session.execute(db.insert(CommentArchive).from_select(
+        ["id", "message", "date", "card_id", "user_id"],
+        db.select(Comment.id, Comment.message, Comment.date, Comment.card_id, Comment.user_id)
+        .where(Comment.card_id.in_(ids))
+    ))
+
+    # Remove the archived comments and cards from the hot tables
+    db.session.execute(
+        db.delete(Comment).where(Comment.card_id.in_(ids)),
+        execution_options={"synchronize_session": False}
+    )
+    db.session.execute(
+        db.delete(Card).where(Card.id.in_(ids)),
+        execution_options={"synchronize_session": False}
+    )
+
+    return len(ids), comments.rowcount
+
+
+def purge_user(user_id):
+    """
+    Delete all of the cards and comments, active and archived, belonging to
+    the user with the given id, with one DELETE statement per table.
+
+    Returns the number of active cards and comments that were deleted. The
+    caller commits.
+    """
+    # Delete the comments the user made, and every comment on the user's cards
+    user_cards = db.select(Card.id).where(Card.user_id == user_id)
+    comments = db.session.execute(
+        db.delete(Comment).where(db.or_(Comment.user_id == user_id, Comment.card_id.in_(user_cards))),
+        execution_options={"synchronize_session": False}
+    )
+
+    # Delete the user's cards
+    cards = db.session.execute(
+        db.delete(Card).where(Card.user_id == user_id),
+        execution_options={"synchronize_session": False}
+    )
+
+    # Do the same for the user's archived comments and cards
+    archived_cards = db.select(CardArchive.id).where(CardArchive.user_id == user_id)
+    db.session.execute(
+        db.delete(CommentArchive).where(db.or_(CommentArchive.user_id == user_id, CommentArchive.card_id.in_(archived_cards))),
+        execution_options={"synchronize_session": False}
+    )
+    db.session.execute(
+        db.delete(CardArchive).where(CardArchive.user_id == user_id),
+        execution_options={"synchronize_session": False}
+    )
+
+    return cards.rowcount, comments.rowcount
+
+
+def purge_batch(user_id, batch_size):
+    """
+    Delete the next batch of rows belonging to the user with the given id,
+    from the comments, the cards, the archived comments and the archived
+    cards in turn.
+
+    Returns the number of rows that were deleted, which is 0 once there's
+    nothing left to purge. The caller commits.
+    """
+    user_cards = db.select(Card.id).where(Card.user_id == user_id)
+    archived_cards = db.select(CardArchive.id).where(CardArchive.user_id == user_id)
+
+    # The comments go before the cards they're on, so nothing is left to the
+    # database's cascades and every row is counted
+    tables = [
+        (Comment, db.or_(Comment.user_id == user_id, Comment.card_id.in_(user_cards))),
+        (Card, Card.user_id == user_id),
+        (CommentArchive, db.or_(CommentArchive.user_id == user_id, CommentArchive.card_id.in_(archived_cards))),
+        (CardArchive, CardArchive.user_id == user_id),
+    ]
+
+    # Delete a batch from the first table with rows left
+    for model, condition in tables:
+        ids = db.session.scalars(db.select(model.id).where(condition).order_by(model.id).limit(batch_size)).all()
+        if ids:
+            db.session.execute(
+                db.delete(model).where(model.id.in_(ids)),
+                execution_options={"synchronize_session": False}
+            )
+            return len(ids)
+
+    return 0
+
+
+class ArchiveParams(Schema):
+    """
+    The parameters of an 'archive' job, the same as the 'archive' command's.
+    """
+    older_than = fields.Integer(load_default=90, validate=Range(min=0))
+    batch_size = fields.Integer(load_default=1000, validate=Range(min=1, max=10000))
+
+
+class DeleteCardsParams(Schema):
+    """
+    The parameters of a 'delete_cards' job, the same filters as DELETE /cards.
+    """
+    status = fields.String(validate=OneOf(VALID_STATUS))
+    priority = fields.String(validate=OneOf(VALID_PRIORITY))
+    before = fields.Date()
+    batch_size = fields.Integer(load_default=1000, validate=Range(min=1, max=10000))
+
+    @validates_schema
+    def validate_filter(self, data, **kwargs):
+        # Refuse to delete every card when no filter was given
+        if not data.get("status") and not data.get("priority") and not data.get("before"):
+            raise ValidationError("At least one of status, priority or before is required")
+
+
+class PurgeParams(Schema):
+    """
+    The parameters of a 'purge' job, the same as the 'purge' command's, and
+    the number of rows to delete in each chunk.
+    """
+    email = fields.String(required=True)
+    batch_size = fields.Integer(load_default=1000, validate=Range(min=1, max=10000))
+
+
+def _run_archive(job, params):
+    cutoff = date.today() - timedelta(days=params["older_than"])
+    cards, _ = archive_batch(cutoff, params["batch_size"])
+    job.progress += cards
+    return cards == 0
+
+
+def _run_delete_cards(job, params):
+    # Only ever delete the cards of the user that created the job
+    stmt = db.select(Card.id).where(Card.user_id == job.user_id)
+    if params.get("status"):
+        stmt = stmt.where(Card.status == params["status"])
+    if params.get("priority"):
+        stmt = stmt.where(Card.priority == params["priority"])
+    if params.get("before"):
+        stmt = stmt.where(Card.date < params["before"])
+
+    ids = db.session.scalars(stmt.order_by(Card.id).limit(params["batch_size"])).all()
+    if not ids:
+        return True
+
+    # The comments are deleted by the database through ON DELETE CASCADE
+    db.session.execute(
+        db.delete(Card).where(Card.id.in_(ids)),
+        execution_options={"synchronize_session": False}
+    )
+    job.progress += len(ids)
+    return False
+
+
+def _run_purge(job, params):
+    user_id = db.session.scalar(db.select(User.id).where(User.email == params["email"]))
+    if user_id is None:
+        return True
+
+    deleted = purge_batch(user_id, params["batch_size"])
+    job.progress += deleted
+    return deleted == 0
+
+
+# The kinds of job, with the schema of their parameters, whether only admins
+# can create them, and the function that runs one chunk of the job and
+# returns whether the job is done
+JOB_KINDS = {
+    "archive": (ArchiveParams(), True, _run_archive),
+    "delete_cards": (DeleteCardsParams(), False, _run_delete_cards),
+    "purge": (PurgeParams(), True, _run_purge),
+}
+
+
+def claim_job(stale_after):
+    """
+    Claim the oldest queued job, or a running job whose worker has stopped
+    saving its progress, and mark it as running.
+
+    Returns the job, or None if there isn't one.
+    """
+    now = datetime.now()
+    stale = now - timedelta(seconds=stale_after)
+
+    # SKIP LOCKED stops two workers from claiming the same job
+    job = db.session.scalars(
+        db.select(Job)
+        .where(db.or_(
+            Job.status == JOB_STATUS[0],
+            db.and_(Job.status == JOB_STATUS[1], Job.heartbeat_at < stale)
+        ))
+        .order_by(Job.id)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+    ).first()
+
+    if job is None:
+        db.session.rollback()
+        return None
+
+    job.status = JOB_STATUS[1]
+    job.started_at = job.started_at or now
+    job.heartbeat_at = now
+    job.claimed_at = now
+    db.session.commit()
+    return job
+
+
+def _save_claimed(job, claimed_at):
+    """
+    Save the heartbeat of a job in the current transaction, only if the
+    worker still holds the claim it made at claimed_at. Returns whether it
+    does, and if not the caller rolls back.
+    """
+    result = db.session.execute(
+        db.update(Job)
+        .where(Job.id == job.id, Job.claimed_at == claimed_at)
+        .values(heartbeat_at=datetime.now()),
+        execution_options={"synchronize_session": False}
+    )
+    return result.rowcount == 1
+
+
+def run_job(job):
+    """
+    Run a claimed job to completion, one chunk at a time, saving the
+    progress after each chunk.
+
+    Each chunk is only committed while the worker still holds its claim on
+    the job. If the job was taken over by another worker because this one
+    was too slow, the chunk is rolled back and the job is left to the other
+    worker.
+    """
+    schema, _, run_chunk = JOB_KINDS[job.kind]
+    claimed_at = job.claimed_at
+
+    try:
+        params = schema.load(job.params)
+        while True:
+            done = run_chunk(job, params)
+            if not _save_claimed(job, claimed_at):
+                return _lose_claim(job)
+            db.session.commit()
+            if done:
+                break
+    except Exception as error:
+        db.session.rollback()
+        job.status = JOB_STATUS[3]
+        job.error = repr(error)
+    else:
+        job.status = JOB_STATUS[2]
+
+    job.finished_at = datetime.now()
+    if not _save_claimed(job, claimed_at):
+        return _lose_claim(job)
+    db.session.commit()
+
+
+def _lose_claim(job):
+    """
+    Roll back the work done since the last commit, after another worker has
+    taken the job over.
+    """
+    db.session.rollback()
+    current_app.logger.warning("Job %s was taken over by another worker", job.id)
+
+
+def work(app, stop, burst=False):
+    """
+    Run jobs until stop is set. When there are no jobs, or claiming or
+    running one fails, wait for JOB_POLL_INTERVAL seconds before looking
+    again, or return if burst is True.
+    """
+    while not stop.is_set():
+        with app.app_context():
+            try:
+                job = claim_job(app.config["JOB_STALE_AFTER"])
+                if job is not None:
+                    app.logger.info("Running job %s (%s)", job.id, job.kind)
+                    run_job(job)
+                    continue
+            except Exception:
+                # Keep the worker running through errors like a dropped
+                # database connection, a stale job is claimed again later
+                app.logger.exception("Worker failed to claim or run a job")
+                db.session.rollback()
+
+        if burst:
+            return
+        stop.wait(app.config["JOB_POLL_INTERVAL"])
+
+
+def start_workers(app, count, burst=False):
+    """
+    Start the given number of worker threads, and return them along with the
+    event that stops them.
+    """
+    stop = threading.Event()
+    threads = [
+        threading.Thread(target=work, args=(app, stop, burst), name=f"job-worker-{i}", daemon=True)
+        for i in range(count)
+    ]
+    for thread in threads:
+        thread.start()
+    return threads, stop
+
+
+def start_workers_when_serving(app, count):
+    """
+    Start the given number of worker threads when the app handles its first
+    request, so they only run in processes that serve requests, and not in
+    CLI commands or in a server's parent process before it forks.
+    """
+    lock = threading.Lock()
+    started = []
+
+    def start():
+        if started:
+            return
+        with lock:
+            if not started:
+                started.append(start_workers(app, count))
+
+    app.before_request(start)
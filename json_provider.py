@@ -0,0 +1,143 @@
+import dataclasses
+import decimal
+import json
+import uuid
+from datetime import date
+
+from flask.json.provider import JSONProvider
+
+# orjson is an optional dependency, it's used when it's installed and the
+# standard library json module is used otherwise
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _default(o):
+    """
+    This function is called for any object the encoder can't serialize by
+    itself. Dates are encoded as ISO 8601 strings, the same as orjson does.
+    """
+    if isinstance(o, date):
+        return o.isoformat()
+
+    if isinstance(o, (decimal.Decimal, uuid.UUID)):
+        return str(o)
+
+    if dataclasses.is_dataclass(o):
+        return dataclasses.asdict(o)
+
+    if hasattr(o, "__html__"):
+        return str(o.__html__())
+
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+class FastJSONProvider(JSONProvider):
+    """
+    This class is the JSON provider used by the app for every JSON response,
+    including the ones made by the Marshmallow schemas' jsonify.
+
+    It encodes with orjson when it's installed, and falls back to the
+    standard library json module. Responses that are a list with at least
+    JSON_STREAM_THRESHOLD items are streamed one element at a time, in
+    chunks of JSON_STREAM_CHUNK_SIZE bytes, rather than being encoded into
+    one large string first.
+    """
+
+    # Whether to escape non-ASCII characters, only used by the json module
+    ensure_ascii = True
+
+    # Whether to sort the keys of objects
+    sort_keys = False
+
+    # Whether to leave out whitespace, None means only in debug mode
+    compact = None
+
+    # The mimetype of the responses
+    mimetype = "application/json"
+
+    def dumps(self, obj, **kwargs):
+        """
+        Serialize data as a JSON string.
+
+        orjson is only used when no keyword arguments are given, as it
+        doesn't support the json module's options.
+        """
+        if orjson is not None and not kwargs:
+            return self._encode(obj).decode("utf-8")
+
+        kwargs.setdefault("default", _default)
+        kwargs.setdefault("ensure_ascii", self.ensure_ascii)
+        kwargs.setdefault("sort_keys", self.sort_keys)
+        return json.dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        """
+        Deserialize data from a JSON string or bytes.
+        """
+        if orjson is not None and not kwargs:
+            return orjson.loads(s)
+
+        return json.loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        """
+        Serialize the given arguments as JSON, and return a Response with it.
+
+        Lists with at least JSON_STREAM_THRESHOLD items are streamed.
+        """
+        obj = self._prepare_response_obj(args, kwargs)
+        threshold = self._app.config.get("JSON_STREAM_THRESHOLD", 1000)
+
+        if isinstance(obj, list) and len(obj) >= threshold:
+            return self._app.response_class(self._stream(obj), mimetype=self.mimetype)
+
+        return self._app.response_class(self._encode(obj, self._indent()) + b"\n", mimetype=self.mimetype)
+
+    def _indent(self):
+        """
+        Whether the output should be indented to be easier to read.
+        """
+        return (self.compact is None and self._app.debug) or self.compact is False
+
+    def _encode(self, obj, indent=False):
+        """
+        Serialize data as JSON bytes.
+        """
+        if orjson is not None:
+            option = orjson.OPT_NON_STR_KEYS
+            if self.sort_keys:
+                option |= orjson.OPT_SORT_KEYS
+            if indent:
+                option |= orjson.OPT_INDENT_2
+            return orjson.dumps(obj, default=_default, option=option)
+
+        if indent:
+            return self.dumps(obj, indent=2).encode("utf-8")
+
+        return self.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+    def _stream(self, items):
+        """
+        Yield a JSON array of the given items, encoding one item at a time
+        and yielding the output in chunks.
+        """
+        chunk_size = self._app.config.get("JSON_STREAM_CHUNK_SIZE", 64 * 1024)
+        chunk = [b"["]
+        size = 1
+
+        for i, item in enumerate(items):
+            encoded = self._encode(item)
+            chunk.append(b"," + encoded if i else encoded)
+            size += len(encoded) + 1
+
+            # Yield the chunk once it's big enough
+            if size >= chunk_size:
+                yield b"".join(chunk)
+                chunk = []
+                size = 0
+
+        chunk.append(b"]\n")
+        yield b"".join(chunk)
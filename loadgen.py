@@ -0,0 +1,307 @@
+import http.client
+import json
+import math
+import random
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+
+class Client:
+    """
+    This class is a minimal HTTP client that keeps its connection open
+    between requests, so the load test measures the server rather than the
+    cost of opening connections.
+
+    Each worker thread has its own client, as connections can't be shared.
+    """
+
+    def __init__(self, url, timeout):
+        parts = urlsplit(url)
+        self._connection_class = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+        self._netloc = parts.netloc
+        self._prefix = parts.path.rstrip("/")
+        self._timeout = timeout
+        self._connection = None
+
+    def request(self, method, path, body=None, token=None):
+        """
+        Send a request, and return the status code and the decoded JSON body.
+        """
+        headers = {"Content-Type": "application/json"}
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+        payload = json.dumps(body) if body is not None else None
+
+        # Retry once on a new connection if the server closed the old one
+        for attempt in (0, 1):
+            reused = self._connection is not None
+            if self._connection is None:
+                self._connection = self._connection_class(self._netloc, timeout=self._timeout)
+
+            try:
+                self._connection.request(method, self._prefix + path, body=payload, headers=headers)
+                response = self._connection.getresponse()
+                data = response.read()
+            except (http.client.HTTPException, OSError):
+                self.close()
+                if attempt or not reused:
+                    raise
+                continue
+
+            if response.will_close:
+                self.close()
+
+            try:
+                return response.status, json.loads(data) if data else None
+            except ValueError:
+                return response.status, None
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+class Session:
+    """
+    This class is a logged in user, with the ids of their cards.
+    """
+
+    def __init__(self, email, token, card_ids):
+        self.email = email
+        self.token = token
+        self.card_ids = card_ids
+        self.lock = threading.Lock()
+
+    def card_id(self):
+        with self.lock:
+            return random.choice(self.card_ids) if self.card_ids else None
+
+    def add_card(self, card_id):
+        with self.lock:
+            self.card_ids.append(card_id)
+
+
+def _card_path(session, suffix=""):
+    card_id = session.card_id()
+    # Fall back to a card that doesn't exist, which is counted as an error
+    return f"/cards/{card_id if card_id is not None else 0}{suffix}"
+
+
+def _list_cards(client, session, password):
+    return client.request("GET", "/cards/", token=session.token)
+
+
+def _get_card(client, session, password):
+    return client.request("GET", _card_path(session), token=session.token)
+
+
+def _create_card(client, session, password):
+    status, body = client.request("POST", "/cards/", {
+        "title": f"Load test card {random.randrange(1_000_000)}",
+        "description": "Created by the load test",
+        "status": "To Do",
+        "priority": random.choice(("Low", "Medium", "High")),
+    }, token=session.token)
+    if status < 300 and body:
+        session.add_card(body["id"])
+    return status, body
+
+
+def _update_card(client, session, password):
+    return client.request("PATCH", _card_path(session), {
+        "description": f"Updated by the load test {random.randrange(1_000_000)}",
+    }, token=session.token)
+
+
+def _list_comments(client, session, password):
+    return client.request("GET", _card_path(session, "/comments/"), token=session.token)
+
+
+def _create_comment(client, session, password):
+    return client.request("POST", _card_path(session, "/comments/"), {
+        "message": "Comment from the load test",
+    }, token=session.token)
+
+
+def _login(client, session, password):
+    return client.request("POST", "/auth/login", {"email": session.email, "password": password})
+
+
+# The routes the load test can send requests to, by the name used in the mix
+ROUTES = {
+    "list_cards": _list_cards,
+    "get_card": _get_card,
+    "create_card": _create_card,
+    "update_card": _update_card,
+    "list_comments": _list_comments,
+    "create_comment": _create_comment,
+    "login": _login,
+}
+
+
+def parse_mix(mix):
+    """
+    Parse a mix like 'list_cards=5,update_card=1' into a dict of weights.
+    """
+    weights = {}
+    for item in mix.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if name not in ROUTES:
+            raise ValueError(f"Unknown route {name}, must be one of {', '.join(ROUTES)}")
+        weights[name] = float(weight) if weight else 1.0
+    return weights
+
+
+def login_users(url, emails, password, concurrency, timeout):
+    """
+    Log in every user through /auth/login and get the ids of their cards.
+    The logins are done in parallel, as each one hashes a password.
+    """
+    def login(email):
+        client = Client(url, timeout)
+        try:
+            status, body = client.request("POST", "/auth/login", {"email": email, "password": password})
+            if status == 429:
+                raise RuntimeError(f"Could not log in {email}: rate limited, start the server with RATELIMIT_ENABLED=false")
+            if status != 200:
+                raise RuntimeError(f"Could not log in {email}: {status} {body}")
+            token = body["access_token"]
+            _, cards = client.request("GET", "/cards/", token=token)
+            return Session(email, token, [card["id"] for card in cards or []])
+        finally:
+            client.close()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(login, emails))
+
+
+def _percentile(values, percent):
+    """
+    Return the nearest-rank percentile of a sorted list.
+    """
+    if not values:
+        return None
+    rank = max(1, math.ceil(percent / 100 * len(values)))
+    return values[rank - 1]
+
+
+def _summarise(samples, seconds):
+    """
+    Summarise the (latency, ok) samples of one route.
+    """
+    latencies = sorted(latency for latency, _ in samples)
+    errors = sum(1 for _, ok in samples if not ok)
+    return {
+        "requests": len(samples),
+        "errors": errors,
+        "error_rate": round(errors / len(samples), 4) if samples else 0.0,
+        "throughput": round(len(samples) / seconds, 2) if seconds else 0.0,
+        "p50_ms": _round_ms(_percentile(latencies, 50)),
+        "p95_ms": _round_ms(_percentile(latencies, 95)),
+        "p99_ms": _round_ms(_percentile(latencies, 99)),
+    }
+
+
+def _round_ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 2)
+
+
+def run_load(url, sessions, password, weights, concurrency, duration, interval, timeout):
+    """
+    Run a closed-loop load test: each of the concurrency workers sends a
+    request, waits for the response, and immediately sends the next one,
+    picking the route from the weighted mix and using the sessions in turn.
+
+    Returns a report with the summary of each route over the whole run, and
+    for each interval of the run.
+    """
+    names = list(weights)
+    route_weights = [weights[name] for name in names]
+    samples = []
+    samples_lock = threading.Lock()
+    start = time.perf_counter()
+    deadline = start + duration
+
+    def worker(index):
+        client = Client(url, timeout)
+        rng = random.Random(index)
+        session_index = index
+        local = []
+
+        try:
+            while True:
+                sent = time.perf_counter()
+                if sent >= deadline:
+                    break
+
+                name = rng.choices(names, route_weights)[0]
+                session = sessions[session_index % len(sessions)]
+                session_index += concurrency
+
+                try:
+                    status, _ = ROUTES[name](client, session, password)
+                    ok = status < 400
+                except (http.client.HTTPException, OSError):
+                    ok = False
+
+                local.append((name, sent - start, time.perf_counter() - sent, ok))
+        finally:
+            client.close()
+            with samples_lock:
+                samples.extend(local)
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    elapsed = time.perf_counter() - start
+
+    # Group the samples by route, and by interval and route
+    by_route = defaultdict(list)
+    by_interval = defaultdict(lambda: defaultdict(list))
+    for name, offset, latency, ok in samples:
+        by_route[name].append((latency, ok))
+        by_interval[int(offset // interval)][name].append((latency, ok))
+
+    return {
+        "url": url,
+        "concurrency": concurrency,
+        "users": len(sessions),
+        "duration_s": round(elapsed, 2),
+        "mix": weights,
+        "total": _summarise([(latency, ok) for _, _, latency, ok in samples], elapsed),
+        "routes": {name: _summarise(by_route[name], elapsed) for name in names if by_route[name]},
+        "timeline": [
+            {
+                "start_s": bucket * interval,
+                "routes": {
+                    name: _summarise(route_samples, min(interval, elapsed - bucket * interval))
+                    for name, route_samples in by_interval[bucket].items()
+                },
+            }
+            for bucket in sorted(by_interval)
+        ],
+    }
+
+
+def format_table(report):
+    """
+    Format the summary of each route in a report as a console table.
+    """
+    columns = ("requests", "throughput", "p50_ms", "p95_ms", "p99_ms", "error_rate")
+    header = f"{'route':<16}" + "".join(f"{column:>12}" for column in columns)
+    lines = [header, "-" * len(header)]
+
+    rows = list(report["routes"].items()) + [("total", report["total"])]
+    for name, summary in rows:
+        cells = "".join(f"{'-' if summary[column] is None else summary[column]:>12}" for column in columns)
+        lines.append(f"{name:<16}{cells}")
+
+    return "\n".join(lines)
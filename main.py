@@ -1,11 +1,16 @@
 import os
 from flask import Flask
+from werkzeug.middleware.proxy_fix import ProxyFix
 from marshmallow.exceptions import ValidationError
 
-from init import db, ma, bcrypt, jwt
+from init import db, ma, bcrypt, jwt, compress, profiler, rate_limiter
+from json_provider import FastJSONProvider
 from controllers.cli_controller import db_commands
+from controllers.bench_controller import bench_commands
 from controllers.auth_controller import auth
 from controllers.card_controller import card
+from controllers.job_controller import jobs
+from jobs import start_workers_when_serving
 
 def create_app():
     """
@@ -16,9 +21,17 @@ def create_app():
     # Create a new Flask instance
     app = Flask(__name__)
 
+    # Use the fast JSON provider for every JSON response
+    # This uses orjson when it's installed, and streams large lists
+    app.json = FastJSONProvider(app)
+
     # Set the JSON sort keys to False
     # This is necessary for the Marshmallow schema to work correctly
     app.json.sort_keys = False
+
+    # Set the number of items from which a JSON list response is streamed
+    # This keeps large responses from being built as one big string
+    app.config["JSON_STREAM_THRESHOLD"] = int(os.environ.get("JSON_STREAM_THRESHOLD", 1000))
     
     # Set the secret key for the app
     # This is used for signing sessions and JWTs
@@ -27,6 +40,14 @@ def create_app():
     # Set the database URI for the app
     # This is used by SQLAlchemy to connect to the database
     app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URI")
+
+    # Set how many hours Idempotency-Key responses are kept for
+    # Keys older than this are deleted by the expire-idempotency-keys command
+    app.config["IDEMPOTENCY_KEY_TTL"] = int(os.environ.get("IDEMPOTENCY_KEY_TTL", 24))
+
+    # Set how many seconds a request can hold an Idempotency-Key without
+    # responding, before a retry takes the key over
+    app.config["IDEMPOTENCY_KEY_LEASE"] = int(os.environ.get("IDEMPOTENCY_KEY_LEASE", 60))
     
     # Initialise the database
     # This is necessary for the app to be able to use the database
@@ -44,6 +65,42 @@ def create_app():
     # This is necessary for generating and verifying JWTs
     jwt.init_app(app)
 
+    # Set the gzip compression level for responses, from 1 to 9
+    # Higher levels send fewer bytes but use more CPU
+    app.config["COMPRESS_GZIP_LEVEL"] = int(os.environ.get("COMPRESS_GZIP_LEVEL", 6))
+
+    # Initialise the Compress object
+    # This is necessary for compressing large JSON responses
+    compress.init_app(app)
+
+    # Set the fraction of requests to profile, from 0 to 1
+    # Admins can also profile a single request with the X-Profile header
+    app.config["PROFILE_SAMPLE_RATE"] = float(os.environ.get("PROFILE_SAMPLE_RATE", 0))
+
+    # Initialise the Profiler object
+    # This is necessary for finding out where the time in a request goes
+    profiler.init_app(app)
+
+    # Set how many reverse proxies sit in front of the app
+    # Each one adds to X-Forwarded-For, so the client's address is taken from
+    # there rather than being the address of the nearest proxy, which would
+    # put every client in the same rate limit
+    app.config["TRUSTED_PROXIES"] = int(os.environ.get("TRUSTED_PROXIES", 0))
+    if app.config["TRUSTED_PROXIES"]:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config["TRUSTED_PROXIES"], x_proto=app.config["TRUSTED_PROXIES"])
+
+    # Set whether expensive routes are rate limited
+    # This can be turned off for load testing from a single address
+    app.config["RATELIMIT_ENABLED"] = os.environ.get("RATELIMIT_ENABLED", "true").lower() == "true"
+
+    # Set the Redis URL the rate limits are shared through, if any
+    # Without it, each process keeps its own rate limits in memory
+    app.config["RATELIMIT_STORAGE_URL"] = os.environ.get("RATELIMIT_STORAGE_URL")
+
+    # Initialise the RateLimiter object
+    # This is necessary for stopping a single client from using up the workers
+    rate_limiter.init_app(app)
+
     # Register the error handler for the ValidationError exception
     # This is necessary for returning validation errors as JSON responses
     @app.errorhandler(ValidationError)
@@ -53,6 +110,10 @@ def create_app():
     # Register the blueprint for the database commands
     # This is necessary for using the database commands
     app.register_blueprint(db_commands)
+
+    # Register the blueprint for the benchmark commands
+    # This is necessary for using the load test commands
+    app.register_blueprint(bench_commands)
     
     # Register the blueprint for the authentication controller
     # This is necessary for using the authentication controller
@@ -62,6 +123,26 @@ def create_app():
     # This is necessary for using the card controller
     app.register_blueprint(card)
 
+    # Register the blueprint for the job controller
+    # This is necessary for creating jobs and following their progress
+    app.register_blueprint(jobs)
+
+    # Set the number of worker threads that run jobs inside the app
+    # The default of 0 leaves running jobs to the 'flask db worker' command
+    app.config["JOB_WORKERS"] = int(os.environ.get("JOB_WORKERS", 0))
+
+    # Set how long workers wait between looking for jobs, in seconds
+    app.config["JOB_POLL_INTERVAL"] = float(os.environ.get("JOB_POLL_INTERVAL", 1))
+
+    # Set how long a running job can go without saving its progress before
+    # another worker takes it over, in seconds
+    app.config["JOB_STALE_AFTER"] = int(os.environ.get("JOB_STALE_AFTER", 300))
+
+    # Start the worker threads once the app serves its first request
+    # These run jobs without blocking the workers that handle requests
+    if app.config["JOB_WORKERS"]:
+        start_workers_when_serving(app, app.config["JOB_WORKERS"])
+
     # Register the blueprint for the comment controller
     # This is necessary for using the comment controller
     
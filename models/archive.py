@@ -0,0 +1,91 @@
+from init import db
+from models.card import VALID_STATUS
+
+# The statuses a card has to be in before it can be archived
+ARCHIVE_STATUS = (VALID_STATUS[2], VALID_STATUS[4])
+
+class CardArchive(db.Model):
+    """
+    This class represents the archived Card model in the database
+
+    Cards in a terminal status are moved here by the 'archive' command so
+    the cards table, and its indexes, only hold the cards that are in use.
+    An archived card keeps the id it had in the cards table.
+
+    Columns:
+    - id: The primary key of the card
+    - title: The title of the card
+    - description: The description of the card
+    - status: The status of the card
+    - priority: The priority of the card
+    - date: The date of the card
+    - user_id: The foreign key of the user that the card belongs to
+    - archived_at: The date the card was archived
+    """
+
+    __tablename__ = "cards_archive"
+
+    # The primary key of the card
+    id = db.Column(db.Integer, primary_key=True)
+
+    # The title of the card
+    title = db.Column(db.String, nullable=False)
+
+    # The description of the card
+    description = db.Column(db.String)
+
+    # The status of the card
+    status = db.Column(db.String)
+
+    # The priority of the card
+    priority = db.Column(db.String)
+
+    # The date of the card
+    date = db.Column(db.Date)
+
+    # The foreign key of the user that the card belongs to
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False, index=True)
+
+    # The date the card was archived
+    archived_at = db.Column(db.Date)
+
+    # The relationship between the card and the user
+    user = db.relationship("User")
+
+    # The relationship between the card and its comments
+    comments = db.relationship("CommentArchive", back_populates="card", cascade="all, delete", passive_deletes=True)
+
+class CommentArchive(db.Model):
+    """
+    This class represents the archived Comment model in the database
+
+    The comments of a card are archived along with the card.
+
+    Columns:
+    - id: The primary key of the comment
+    - message: The message of the comment
+    - FK to card_id: The foreign key of the archived card that the comment belongs to
+    - FK to user_id: The foreign key of the user that the comment belongs to
+    """
+
+    __tablename__ = "comments_archive"
+
+    # The primary key of the comment
+    id = db.Column(db.Integer, primary_key=True)
+
+    # The message of the comment
+    message = db.Column(db.String)
+
+    date = db.Column(db.Date)
+
+    # The foreign key of the archived card that the comment belongs to
+    card_id = db.Column(db.Integer, db.ForeignKey("cards_archive.id", ondelete="CASCADE"), nullable=False, index=True)
+
+    # The foreign key of the user that the comment belongs to
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
+
+    # The relationship between the comment and the card
+    card = db.relationship("CardArchive", back_populates="comments")
+
+    # The relationship between the comment and the user
+    user = db.relationship("User")
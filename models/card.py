@@ -17,6 +17,8 @@ class Card(db.Model):
     - priority: The priority of the card
     - date: The date of the card
     - user_id: The foreign key of the user that the card belongs to
+    - version: The number of times the card has been written, used to detect
+    conflicting updates
     """
 
     __tablename__ = "cards"
@@ -42,9 +44,23 @@ class Card(db.Model):
     # The foreign key of the user that the card belongs to
     user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
 
+    # The version of the card, which is incremented on every update
+    version = db.Column(db.Integer, nullable=False)
+
+    # SQLAlchemy checks and increments the version whenever it writes the card
+    __mapper_args__ = {"version_id_col": version}
+
     # The relationship between the card and the user
     user = db.relationship("User", back_populates="cards")
-    comments = db.relationship("Comment", back_populates="card", cascade="all, delete")
+
+    # The relationship between the card and its comments
+    # passive_deletes leaves deleting the comments to the ON DELETE CASCADE
+    # foreign key, so they are never loaded just to be deleted
+    comments = db.relationship("Comment", back_populates="card", cascade="all, delete", passive_deletes=True)
+
+# Counts the cards that are "In Progress", built once so its compiled SQL is
+# reused from SQLAlchemy's cache
+IN_PROGRESS_COUNT = db.select(db.func.count()).select_from(Card).where(Card.status == VALID_STATUS[1])
 
 class CardSchema(ma.Schema):
     user = fields.Nested("UserSchema", only=("id", "name", "email"))
@@ -56,19 +72,20 @@ class CardSchema(ma.Schema):
     
     priority = fields.String(validate=OneOf(VALID_PRIORITY))
 
+    version = fields.Integer()
+
     @validates("status")
     def validate_status(self, value):
         if value == VALID_STATUS[1]:
             # Check if an existing card has the status "In Progress"
-            stmt = db.select(db.func.count()).select_from(Card).where(Card.status == VALID_STATUS[1])
-            count = db.session.scalar(stmt)
+            count = db.session.scalar(IN_PROGRESS_COUNT)
             if count > 0:
                 raise ValidationError("Status cannot be 'In Progress'")
             
         
     
     class Meta:
-        fields = ("id", "title", "description", "status", "priority", "date", "user", "comments")
+        fields = ("id", "title", "description", "status", "priority", "date", "version", "user", "comments")
 
     
 
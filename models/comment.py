@@ -10,6 +10,8 @@ class Comment(db.Model):
     - message: The message of the comment
     - FK to card_id: The foreign key of the card that the comment belongs to
     - FK to user_id: The foreign key of the user that the comment belongs to
+    - version: The number of times the comment has been written, used to
+    detect conflicting updates
 """
 
     __tablename__ = "comments"
@@ -23,11 +25,18 @@ class Comment(db.Model):
     date = db.Column(db.Date)
 
     # The foreign key of the card that the comment belongs to
-    card_id = db.Column(db.Integer, db.ForeignKey("cards.id"), nullable=False)
+    # Deleting a card deletes its comments in the database
+    card_id = db.Column(db.Integer, db.ForeignKey("cards.id", ondelete="CASCADE"), nullable=False)
 
     # The foreign key of the user that the comment belongs to
     user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
 
+    # The version of the comment, which is incremented on every update
+    version = db.Column(db.Integer, nullable=False)
+
+    # SQLAlchemy checks and increments the version whenever it writes the comment
+    __mapper_args__ = {"version_id_col": version}
+
     # The relationship between the comment and the card
     card = db.relationship("Card", back_populates="comments")
 
@@ -47,6 +56,9 @@ class CommentSchema(ma.Schema):
     # The relationship between the comment and the card
     card = fields.Nested("CardSchema", only=("id", "title"))
 
+    # The version of the comment, sent back to detect conflicting updates
+    version = fields.Integer()
+
     class Meta:
         """
         This is the Meta class for the CommentSchema
@@ -55,7 +67,7 @@ class CommentSchema(ma.Schema):
         """
 
         # The fields to include in the JSON response
-        fields = ("id", "message", "card", "user")
+        fields = ("id", "message", "version", "card", "user")
 
 comment_schema = CommentSchema()
 comments_schema = CommentSchema(many=True)
\ No newline at end of file
@@ -0,0 +1,44 @@
+from init import db
+
+class IdempotencyKey(db.Model):
+    """
+    This class represents the IdempotencyKey model in the database
+
+    A row is stored for every request sent with an Idempotency-Key header,
+    so that a retry of the request replays the stored response instead of
+    running the request again. The response is empty while the first
+    request is still running, or if it died before finishing.
+
+    Columns:
+    - user_id: The id of the user that sent the request
+    - key: The value of the Idempotency-Key header
+    - fingerprint: A hash of the method, path and body of the request
+    - status_code: The status code of the response
+    - response: The body of the response
+    - created_at: When the request was first received
+    - claimed_at: When the request running now claimed the key
+    """
+
+    __tablename__ = "idempotency_keys"
+
+    # The user that sent the request, keys are only unique for each user
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+
+    # The value of the Idempotency-Key header
+    key = db.Column(db.String(255), primary_key=True)
+
+    # A SHA-256 hash of the method, path and body of the request
+    fingerprint = db.Column(db.String(64), nullable=False)
+
+    # The status code of the response
+    status_code = db.Column(db.SmallInteger)
+
+    # The body of the response
+    response = db.Column(db.LargeBinary)
+
+    # When the request was first received, used to expire old keys
+    created_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    # When the request running now claimed the key, a retry takes the key
+    # over once this is older than the lease
+    claimed_at = db.Column(db.DateTime, nullable=False)
@@ -0,0 +1,83 @@
+from init import db, ma
+from marshmallow import fields
+
+# The statuses a job goes through
+JOB_STATUS = ("Queued", "Running", "Done", "Failed")
+
+class Job(db.Model):
+    """
+    This class represents the Job model in the database
+
+    A job is a long running operation that's run by a worker rather than in
+    the request that asked for it. Jobs are run in chunks, and the progress
+    is saved after each chunk, so a job can be picked up again by another
+    worker if its worker stops.
+
+    Columns:
+    - id: The primary key of the job
+    - kind: The kind of job, which decides what it does
+    - params: The parameters of the job, as JSON
+    - status: The status of the job
+    - progress: The number of rows the job has processed so far
+    - error: The error the job failed with
+    - user_id: The foreign key of the user that created the job
+    - created_at: When the job was created
+    - started_at: When a worker started the job
+    - heartbeat_at: When the worker last saved the job's progress
+    - claimed_at: When the worker running the job now claimed it
+    - finished_at: When the job finished
+    """
+
+    __tablename__ = "jobs"
+
+    # The primary key of the job
+    id = db.Column(db.Integer, primary_key=True)
+
+    # The kind of job
+    kind = db.Column(db.String(50), nullable=False)
+
+    # The parameters of the job
+    params = db.Column(db.JSON, nullable=False, default=dict)
+
+    # The status of the job, workers look for jobs by status
+    status = db.Column(db.String(20), nullable=False, default=JOB_STATUS[0], index=True)
+
+    # The number of rows the job has processed so far
+    progress = db.Column(db.Integer, nullable=False, default=0)
+
+    # The error the job failed with
+    error = db.Column(db.String)
+
+    # The foreign key of the user that created the job
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+
+    # When the job was created, started, last saved its progress and finished
+    created_at = db.Column(db.DateTime, nullable=False)
+    started_at = db.Column(db.DateTime)
+    heartbeat_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    # When the worker running the job now claimed it, a worker only saves
+    # its progress while this is still the time it claimed the job at
+    claimed_at = db.Column(db.DateTime)
+
+class JobSchema(ma.Schema):
+    """
+    This class represents the JobSchema in the database
+
+    This is used to serialize the Job model into a JSON response
+    """
+
+    params = fields.Dict()
+
+    class Meta:
+        """
+        This is the Meta class for the JobSchema
+
+        It specifies the fields to include in the JSON response
+        """
+
+        # The fields to include in the JSON response
+        fields = ("id", "kind", "params", "status", "progress", "error", "user_id", "created_at", "started_at", "finished_at")
+
+job_schema = JobSchema()
@@ -0,0 +1,185 @@
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+
+from flask import current_app, g, request
+from flask_jwt_extended import get_jwt_identity, verify_jwt_in_request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+class _Sampler(threading.Thread):
+    """
+    This class is a thread that samples the call stack of another thread at
+    a fixed interval, counting how often each stack is seen.
+
+    Sampling only costs a little time on each interval, unlike a tracing
+    profiler which slows down every function call.
+    """
+
+    def __init__(self, thread_id, interval):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+
+            # Walk the stack from the innermost frame outwards
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})")
+                frame = frame.f_back
+
+            self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+class Profiler:
+    """
+    This class profiles individual requests with a sampling profiler.
+
+    A request is profiled when it's sent by an admin with the X-Profile
+    header, or when it's picked at random with a probability of
+    PROFILE_SAMPLE_RATE. Each profile is written to PROFILE_DIR as a
+    collapsed stack file, which can be opened in speedscope or turned into a
+    flame graph, and a JSON file with the endpoint, the timing and the SQL
+    statements the request executed. Only the newest PROFILE_KEEP profiles
+    are kept.
+
+    Requests that aren't profiled only pay for the header and sample rate
+    checks, and one attribute check for each SQL statement. It's set up the
+    same way as the other extensions, by calling init_app with the app.
+    """
+
+    def __init__(self):
+        # The statements of the request being profiled on each thread
+        self._local = threading.local()
+        self._listening = False
+
+    def init_app(self, app):
+        app.config.setdefault("PROFILE_SAMPLE_RATE", 0.0)
+        app.config.setdefault("PROFILE_INTERVAL", 0.001)
+        app.config.setdefault("PROFILE_DIR", os.path.join(app.instance_path, "profiles"))
+        app.config.setdefault("PROFILE_KEEP", 100)
+
+        # Listen once for every engine, rather than adding and removing a
+        # listener in each profiled request while other requests run SQL
+        if not self._listening:
+            event.listen(Engine, "before_cursor_execute", self._record_statement)
+            self._listening = True
+
+        app.before_request(self.before_request)
+        app.teardown_request(self.teardown_request)
+
+    def _record_statement(self, conn, cursor, statement, parameters, context, executemany):
+        statements = getattr(self._local, "statements", None)
+        if statements is not None:
+            statements.append(statement)
+
+    def before_request(self):
+        """
+        Start profiling the request if it's been asked for or sampled.
+        """
+        if "X-Profile" in request.headers:
+            if not self._is_admin():
+                return
+        else:
+            rate = current_app.config["PROFILE_SAMPLE_RATE"]
+            if not rate or random.random() >= rate:
+                return
+
+        sampler = _Sampler(threading.get_ident(), current_app.config["PROFILE_INTERVAL"])
+        self._local.statements = []
+        g.profile = (sampler, time.perf_counter())
+        sampler.start()
+
+    def teardown_request(self, exc):
+        """
+        Stop profiling the request, if it was profiled, and write the profile.
+        """
+        profile = g.pop("profile", None)
+        if profile is None:
+            return
+
+        sampler, start = profile
+        sampler.stop()
+        duration = time.perf_counter() - start
+        statements = self._local.statements
+        self._local.statements = None
+
+        try:
+            self._write(sampler.stacks, statements, duration, exc)
+        except OSError as error:
+            current_app.logger.warning("Could not write profile: %s", error)
+
+    @staticmethod
+    def _is_admin():
+        """
+        Check whether the request was sent by an admin.
+        """
+        # Imported here as the models import init, which imports this module
+        from models.user import User
+
+        try:
+            verify_jwt_in_request(optional=True)
+        except Exception:
+            return False
+
+        identity = get_jwt_identity()
+        if identity is None:
+            return False
+
+        user = current_app.extensions["sqlalchemy"].session.get(User, identity)
+        return bool(user and user.is_admin)
+
+    @staticmethod
+    def _write(stacks, statements, duration, exc):
+        """
+        Write the collapsed stacks and the details of a profile, then delete
+        the oldest profiles.
+        """
+        config = current_app.config
+        directory = config["PROFILE_DIR"]
+        os.makedirs(directory, exist_ok=True)
+
+        name = f"{datetime.now():%Y%m%dT%H%M%S%f}-{request.endpoint}-{uuid.uuid4().hex[:8]}"
+
+        with open(os.path.join(directory, f"{name}.collapsed"), "w") as file:
+            for stack, count in stacks.items():
+                file.write(f"{stack} {count}\n")
+
+        with open(os.path.join(directory, f"{name}.json"), "w") as file:
+            json.dump({
+                "endpoint": request.endpoint,
+                "method": request.method,
+                "path": request.path,
+                "duration_ms": round(duration * 1000, 3),
+                "samples": sum(stacks.values()),
+                "error": repr(exc) if exc else None,
+                "sql": statements,
+            }, file, indent=2)
+
+        # The names start with the time, so sorting them sorts the profiles
+        names = sorted({os.path.splitext(file)[0] for file in os.listdir(directory)})
+        for old in names[:-config["PROFILE_KEEP"]]:
+            for extension in (".collapsed", ".json"):
+                try:
+                    os.remove(os.path.join(directory, old + extension))
+                except FileNotFoundError:
+                    pass
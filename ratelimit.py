@@ -0,0 +1,200 @@
+import math
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from flask import current_app, g, request
+from flask_jwt_extended import get_jwt_identity, verify_jwt_in_request
+
+# redis is an optional dependency, it's only needed to share the buckets
+# between processes with RATELIMIT_STORAGE_URL
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+class MemoryBucketStore:
+    """
+    This class keeps the token buckets in memory, so each process has its own.
+
+    Buckets are kept in the order they were last used, and once there are
+    more than max_keys of them the least recently used are dropped. That
+    bucket has had the longest to refill, so it's the most likely to be full,
+    which is the same as no bucket.
+    """
+
+    def __init__(self, max_keys=100_000):
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self._max_keys = max_keys
+
+    def take(self, key, capacity, rate):
+        """
+        Take a token from the bucket, refilling it at rate tokens a second up
+        to capacity first. Returns whether a token was taken, and if not, how
+        many seconds until one will be available.
+        """
+        now = time.monotonic()
+
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                allowed, retry_after = True, 0.0
+            else:
+                self._buckets[key] = (tokens, now)
+                allowed, retry_after = False, (1 - tokens) / rate
+
+            # Drop the least recently used buckets, without scanning them all
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self._max_keys:
+                self._buckets.popitem(last=False)
+
+        return allowed, retry_after
+
+
+class RedisBucketStore:
+    """
+    This class keeps the token buckets in Redis, so every process shares them.
+
+    Each bucket is updated by a Lua script, which runs atomically in Redis
+    and uses the Redis server's clock, so the app servers' clocks don't need
+    to agree.
+    """
+
+    SCRIPT = """
+    local capacity = tonumber(ARGV[1])
+    local rate = tonumber(ARGV[2])
+    local time = redis.call("TIME")
+    local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+    local bucket = redis.call("HMGET", KEYS[1], "tokens", "updated")
+    local tokens = tonumber(bucket[1]) or capacity
+    local updated = tonumber(bucket[2]) or now
+    tokens = math.min(capacity, tokens + (now - updated) * rate)
+    local allowed = 0
+    local retry_after = 0
+    if tokens >= 1 then
+        tokens = tokens - 1
+        allowed = 1
+    else
+        retry_after = (1 - tokens) / rate
+    end
+    redis.call("HSET", KEYS[1], "tokens", tokens, "updated", now)
+    redis.call("EXPIRE", KEYS[1], math.ceil(capacity / rate) + 1)
+    return {allowed, tostring(retry_after)}
+    """
+
+    def __init__(self, url):
+        if redis is None:
+            raise RuntimeError("RATELIMIT_STORAGE_URL needs the redis package to be installed")
+        self._client = redis.Redis.from_url(url)
+        self._script = self._client.register_script(self.SCRIPT)
+
+    def take(self, key, capacity, rate):
+        allowed, retry_after = self._script(keys=[f"ratelimit:{key}"], args=[capacity, rate])
+        return bool(allowed), float(retry_after)
+
+
+class RateLimiter:
+    """
+    This class limits how often each client can call expensive routes, and
+    how many password hashing requests run at once.
+
+    RATELIMIT_RULES maps an endpoint to the (capacity, period) of its token
+    bucket: each client can send capacity requests at once, and the bucket
+    refills over period seconds. Clients are told apart by their JWT
+    identity, or by their IP address when they aren't logged in, which is
+    only right behind a proxy when TRUSTED_PROXIES is set. The buckets
+    are kept in memory, or in Redis when RATELIMIT_STORAGE_URL is set.
+
+    The endpoints in RATELIMIT_BCRYPT_ENDPOINTS hash passwords with bcrypt,
+    and at most RATELIMIT_BCRYPT_CONCURRENCY of them run at once in each
+    process. A request that can't start within RATELIMIT_BCRYPT_WAIT seconds
+    is turned away.
+
+    Turned away requests get a 429 error with a Retry-After header, and are
+    counted in rejected by endpoint and reason. It's set up the same way as
+    the other extensions, by calling init_app with the app.
+    """
+
+    def __init__(self):
+        self.rejected = Counter()
+        self._rejected_lock = threading.Lock()
+
+    def init_app(self, app):
+        app.config.setdefault("RATELIMIT_ENABLED", True)
+        app.config.setdefault("RATELIMIT_RULES", {
+            "auth.login": (10, 60),
+            "auth.register": (5, 300),
+            "card.get_cards_by_user": (30, 10),
+        })
+        app.config.setdefault("RATELIMIT_STORAGE_URL", None)
+        app.config.setdefault("RATELIMIT_BCRYPT_ENDPOINTS", ("auth.login", "auth.register", "auth.update_user"))
+        app.config.setdefault("RATELIMIT_BCRYPT_CONCURRENCY", os.cpu_count() or 1)
+        app.config.setdefault("RATELIMIT_BCRYPT_WAIT", 1.0)
+
+        if app.config["RATELIMIT_STORAGE_URL"]:
+            self.store = RedisBucketStore(app.config["RATELIMIT_STORAGE_URL"])
+        else:
+            self.store = MemoryBucketStore()
+        self.bcrypt_slots = threading.BoundedSemaphore(app.config["RATELIMIT_BCRYPT_CONCURRENCY"])
+
+        app.before_request(self.before_request)
+        app.teardown_request(self.teardown_request)
+
+    def before_request(self):
+        """
+        Turn the request away if its client has no tokens left, or if too
+        many password hashing requests are already running.
+        """
+        config = current_app.config
+        endpoint = request.endpoint
+
+        if not config["RATELIMIT_ENABLED"]:
+            return
+
+        rule = config["RATELIMIT_RULES"].get(endpoint)
+        if rule:
+            capacity, period = rule
+            allowed, retry_after = self.store.take(f"{endpoint}:{self._identity()}", capacity, capacity / period)
+            if not allowed:
+                return self._reject(endpoint, "rate", retry_after)
+
+        if endpoint in config["RATELIMIT_BCRYPT_ENDPOINTS"]:
+            if not self.bcrypt_slots.acquire(timeout=config["RATELIMIT_BCRYPT_WAIT"]):
+                return self._reject(endpoint, "concurrency", 1)
+            g.bcrypt_slot = True
+
+    def teardown_request(self, exc):
+        """
+        Give back the password hashing slot, if the request took one.
+        """
+        if g.pop("bcrypt_slot", False):
+            self.bcrypt_slots.release()
+
+    @staticmethod
+    def _identity():
+        """
+        Return the JWT identity of the client, or its IP address if it
+        doesn't send a valid token.
+        """
+        try:
+            verify_jwt_in_request(optional=True)
+            identity = get_jwt_identity()
+        except Exception:
+            identity = None
+
+        if identity is not None:
+            return f"user:{identity}"
+        return f"ip:{request.remote_addr}"
+
+    def _reject(self, endpoint, reason, retry_after):
+        with self._rejected_lock:
+            self.rejected[f"{endpoint}:{reason}"] += 1
+
+        current_app.logger.warning("Rejected %s request to %s from %s", reason, endpoint, request.remote_addr)
+        return {"message": "Too many requests, please try again later"}, 429, {"Retry-After": str(max(1, math.ceil(retry_after)))}
@@ -0,0 +1,40 @@
+from flask import request
+
+
+def expected_version(version=None):
+    """
+    Return the version the client expects a row to be at before it's updated,
+    and the status code to return if the row is at a different version.
+
+    The version is taken from the If-Match header when it's sent, with a 412
+    status code, and otherwise from the version field of the request body,
+    with a 409 status code. If neither is given, or If-Match is *, the
+    version is None and the update isn't checked. The ETags are weak, so the
+    version a weak tag names is compared rather than refusing it outright.
+    """
+    if request.if_match:
+        if request.if_match.star_tag:
+            return None, None
+
+        # An ETag that isn't a single version can never match
+        tags = request.if_match.as_set(include_weak=True)
+        if len(tags) != 1 or not next(iter(tags)).isdigit():
+            return -1, 412
+
+        return int(next(iter(tags))), 412
+
+    if version is not None:
+        return version, 409
+
+    return None, None
+
+
+def etag(version):
+    """
+    Return the headers that tell the client the version of a row.
+
+    The ETag is weak, as it only names the version of the row. The body can
+    embed other rows that change without the version changing, and can be
+    sent compressed or not.
+    """
+    return {"ETag": f'W/"{version}"'}